@@ -12,14 +12,29 @@ class GeminiAPI():
         self.model = model
         self.api_key = os.getenv('GEMINI_API_KEY', None)
         genai.configure(api_key=self.api_key)
+        # 重複使用已建立的模型物件
+        self.models = {}
         logger.info(f"Gemini API 已初始化，使用模型: {self.model}")
 
-    def get_response(self, prompt, temperature=0.7):
-        """獲取 Gemini 回應"""
+    def warm_model(self, model_name=None):
+        """預先建立模型物件，避免在回應時才建立"""
+        model_name = model_name or self.model
+        model = self.models.get(model_name)
+        if model is None:
+            model = self.models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+    async def get_response(self, prompt, temperature=0.7, model_name=None):
+        """獲取 Gemini 回應
+
+        prompt 可以是文字，或是文字與圖片（{"mime_type": ..., "data": ...}）組成的列表；
+        model_name 未指定時使用預設模型。
+        使用非同步 API，請求被取消時會一併中止進行中的 HTTP 呼叫，不會繼續消耗配額。
+        """
         try:
-            model = genai.GenerativeModel(self.model)
+            model = self.warm_model(model_name)
             generation_config = GenerationConfig(temperature=temperature)
-            response = model.generate_content(
+            response = await model.generate_content_async(
                 prompt, 
                 generation_config=generation_config,
                 safety_settings='BLOCK_NONE'
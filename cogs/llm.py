@@ -1,23 +1,47 @@
 import os
 import re
 import json
+import time
+import asyncio
 import discord
-from typing import Optional
+from dataclasses import dataclass
+from typing import Awaitable, Dict, List, Optional, Sequence
 from loguru import logger
+from discord import app_commands
 from discord.ext import commands
 from cogs.gemini_api import GeminiAPI
-from cogs.memory import get_memory, save_memory
-from config.config import ConfigManager
+from cogs.memory import get_memory, memory_version, save_memory
+from config.config import BotConfig, atomic_write_json, config
+from utils.log import new_request_id
+from utils.scheduler import ChannelScheduler
+from utils.router import ModelRouter
+from utils.attachments import AttachmentPipeline
+from utils.response_cache import ResponseCache
+from utils.outbound import outbound
 
 PROJECT_ROOT = os.getcwd()
 PERSONALITY_FOLDER = os.path.join(PROJECT_ROOT, "assets/data/personality")
+RESPONSE_CACHE_PATH = os.path.join(PROJECT_ROOT, "assets/data/cache/responses.json")
 os.makedirs(PERSONALITY_FOLDER, exist_ok=True)
+# 每則請求都會記錄的高頻日誌使用獨立類別，方便在日誌設定中抽樣
+llm_logger = logger.bind(category="llm")
 
-def get_prompt(system_prompt: str, user_nick: str, text: str, 
-               personality: Optional[str] = None, 
-               search_results: Optional[str] = None, 
-               memory: Optional[str] = None) -> str:
-    """構建提示詞"""
+class RequestCancelled(Exception):
+    """進行中的生成因訊息被刪除或編輯而取消"""
+
+@dataclass
+class PrewarmedContext:
+    """使用者輸入時預先載入的頻道狀態"""
+    memory: Optional[str]
+    personality: str
+    prompt_prefix: str
+    memory_version: int
+    expires_at: float
+
+def get_prompt_prefix(system_prompt: str,
+                      personality: Optional[str] = None,
+                      memory: Optional[str] = None) -> str:
+    """構建提示詞中與本次輸入無關的前段（系統提示、個性、對話歷史）"""
     prompt = system_prompt or ""
     
     if personality:
@@ -25,6 +49,18 @@ def get_prompt(system_prompt: str, user_nick: str, text: str,
     
     if memory:
         prompt += f"\n\n### 對話歷史：\n{memory}"
+
+    return prompt
+
+def get_prompt(system_prompt: str, user_nick: str, text: str, 
+               personality: Optional[str] = None, 
+               search_results: Optional[str] = None, 
+               memory: Optional[str] = None,
+               prompt_prefix: Optional[str] = None) -> str:
+    """構建提示詞"""
+    if prompt_prefix is None:
+        prompt_prefix = get_prompt_prefix(system_prompt, personality, memory)
+    prompt = prompt_prefix
     
     if search_results:
         prompt += f"\n\n### 參考資料：\n{search_results}"
@@ -36,7 +72,7 @@ def get_prompt(system_prompt: str, user_nick: str, text: str,
 def google_search(query: str) -> str:
     """模擬搜索功能，實際應用中需要實現真正的搜索"""
     # 此處應該實現實際的搜索功能
-    logger.info(f"執行搜索: {query}")
+    llm_logger.info("執行搜索: {}", query)
     return f"關於「{query}」的搜索結果將顯示在這裡。"
 
 def get_channel_name(channel) -> str:
@@ -51,25 +87,71 @@ def get_channel_name(channel) -> str:
 class LLMService(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.config = ConfigManager()
+        self.config = config
         
-        self.system_prompt = self.config.bot_config.get("system_prompt", "")
-        self.personality = self.config.bot_config.get("personality", "")
-        self.gpt_api = self.config.bot_config.get("gpt_api", "gemini")
-        self.model = self.config.bot_config.get("model", "gemini-1.5-flash")
-        self.chat_memory = self.config.bot_config.get("chat_memory", False)
-        self.use_search_engine = self.config.bot_config.get("use_search_engine", False)
+        self.system_prompt = self.config.snapshot.system_prompt
+        self.personality = self.config.snapshot.personality
+        self.gpt_api = self.config.snapshot.gpt_api
+        self.model = self.config.snapshot.model
+        self.chat_memory = self.config.snapshot.chat_memory
+        self.use_search_engine = self.config.snapshot.use_search_engine
+        self.request_timeout = self.config.bot_config.get("request_timeout", 60)
+        self.edit_action = self.config.bot_config.get("edit_action", "regenerate")
+
+        # 進行中的生成（訊息 ID -> 任務）
+        self.inflight: Dict[int, asyncio.Task] = {}
+        # 同頻道依序、跨頻道平行的請求排程
+        self.scheduler = ChannelScheduler(self.config.bot_config.get("max_concurrent_requests", 4))
         
         # 初始化 Gemini API
         self.gpt = GeminiAPI(self.model)
+        # 依輸入特徵與模型狀態選擇模型
+        self.router = ModelRouter(self.model, self.config.bot_config.get("routing", {}))
+        # 圖片附件的下載、縮圖與快取
+        self.attachments = AttachmentPipeline(self.config.bot_config.get("attachments", {}))
+        # 不使用記憶與搜尋時，重複提問的回應快取
+        self.response_cache = ResponseCache(self.config.bot_config.get("response_cache", {}), RESPONSE_CACHE_PATH)
+
+        # 輸入中預熱：頻道 ID -> 預先載入的狀態
+        self.apply_prewarm_settings(self.config.bot_config.get("prewarm", {}))
+        self.prewarmed: Dict[int, PrewarmedContext] = {}
+        self.prewarming: Dict[int, asyncio.Task] = {}
+        self.prewarm_hits = 0
+        self.prewarm_misses = 0
+
+        self.config.subscribe(self.on_config_change)
         logger.info(f"功能 {self.__class__.__name__} 初始化載入成功！")
 
-    def get_response(self, chanel_id: int, user_nick: str, text: str, 
-                    search_results: Optional[str] = None, 
-                    memory: Optional[str] = None) -> str:
-        """獲取 LLM 回應"""
-        # 檢查是否有頻道專屬的個性
-        file_path = os.path.join(PERSONALITY_FOLDER, f"{chanel_id}.json")
+    async def cog_unload(self) -> None:
+        self.config.unsubscribe(self.on_config_change)
+        await self.attachments.close()
+        await asyncio.to_thread(self.response_cache.save, self.response_cache.snapshot())
+
+    def on_config_change(self, old: BotConfig, new: BotConfig) -> None:
+        """設定變更時更新相關屬性，並清除依賴舊設定的預熱狀態"""
+        self.system_prompt = new.system_prompt
+        self.personality = new.personality
+        self.chat_memory = new.chat_memory
+        self.use_search_engine = new.use_search_engine
+        self.request_timeout = new.get("request_timeout", 60)
+        self.edit_action = new.get("edit_action", "regenerate")
+        self.model = self.gpt.model = self.router.default_model = new.model
+        self.router.settings = new.get("routing", {})
+        self.scheduler.max_workers = max(1, new.get("max_concurrent_requests", 4))
+        self.response_cache.configure(new.get("response_cache", {}))
+        self.attachments.configure(new.get("attachments", {}))
+        self.apply_prewarm_settings(new.get("prewarm", {}))
+        self.invalidate_prewarm()
+
+    def apply_prewarm_settings(self, prewarm) -> None:
+        self.prewarm_enabled = prewarm.get("enabled", True)
+        self.prewarm_ttl = prewarm.get("ttl_seconds", 20)
+        self.prewarm_max_concurrent = prewarm.get("max_concurrent", 4)
+        self.prewarm_model = prewarm.get("warm_model", False)
+
+    def get_channel_personality(self, channel_id: int) -> str:
+        """取得頻道專屬的個性，沒有設定時使用全局個性"""
+        file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
         personality = self.personality
         
         if os.path.exists(file_path):
@@ -81,17 +163,62 @@ class LLMService(commands.Cog):
                         personality = channel_personality
             except Exception as e:
                 logger.error(f"讀取個性檔案時發生錯誤: {e}")
-        
-        # 構建提示詞
-        prompt = get_prompt(self.system_prompt, user_nick, text, personality, search_results, memory)
+        return personality
 
-        # 生成回應
+    async def get_response(self, chanel_id: int, user_nick: str, text: str, 
+                    search_results: Optional[str] = None, 
+                    memory: Optional[str] = None,
+                    guild_id=None,
+                    prompt_prefix: Optional[str] = None,
+                    images: Optional[List[dict]] = None) -> str:
+        """獲取 LLM 回應"""
+        prompt = self.build_prompt(chanel_id, user_nick, text, search_results, memory, prompt_prefix)
+
+        # 選擇模型並生成回應
+        model = self.router.route(text, guild_id, chanel_id, has_memory=bool(memory),
+                                  has_search=bool(search_results), has_images=bool(images))
         temperature = 0.5 if search_results else 1.0
-        response = self.gpt.get_response(prompt, temperature=temperature)
+        return await self.call_model(prompt, model, temperature, images)
+
+    def build_prompt(self, chanel_id: int, user_nick: str, text: str,
+                     search_results: Optional[str] = None,
+                     memory: Optional[str] = None,
+                     prompt_prefix: Optional[str] = None) -> str:
+        """構建提示詞（已預熱時直接使用預先構建的前段）"""
+        if prompt_prefix is None:
+            personality = self.get_channel_personality(chanel_id)
+            prompt_prefix = get_prompt_prefix(self.system_prompt, personality, memory)
+        return get_prompt(self.system_prompt, user_nick, text, search_results=search_results, prompt_prefix=prompt_prefix)
+
+    async def call_model(self, prompt: str, model: str, temperature: float,
+                         images: Optional[List[dict]] = None) -> str:
+        """呼叫模型並記錄延遲與錯誤"""
+        # 有圖片時以多模態輸入送出
+        contents = [prompt, *images] if images else prompt
+        started = time.monotonic()
+        response = await self.gpt.get_response(contents, temperature=temperature, model_name=model)
+        self.router.record(model, time.monotonic() - started, bool(response) and not response.startswith("[Gemini 錯誤]"))
         
         return response if response else "無法生成回應"
 
-    def get_search_results(self, text: str, channel_id: Optional[int] = None) -> Optional[str]:
+    async def get_cached_response(self, channel_id: int, user_nick: str, text: str,
+                                  guild_id, prompt_prefix: str) -> str:
+        """提示詞完全由系統提示、個性與輸入決定時，使用回應快取"""
+        if self.response_cache.share_across_users:
+            user_nick = "使用者"
+        prompt = self.build_prompt(channel_id, user_nick, text, prompt_prefix=prompt_prefix)
+        model = self.router.route(text, guild_id, channel_id)
+        temperature = 1.0
+        key = self.response_cache.make_key(prompt, model, temperature)
+        return await self.response_cache.get_or_create(
+            key,
+            lambda: self.call_model(prompt, model, temperature),
+            should_cache=lambda response: bool(response) and not response.startswith("[Gemini 錯誤]")
+            and response != "無法生成回應",
+        )
+
+    async def get_search_results(self, text: str, channel_id: Optional[int] = None, guild_id=None,
+                                 memory_text: Optional[str] = None) -> Optional[str]:
         """判斷是否需要搜索並獲取搜索結果"""
         if not self.use_search_engine:
             return None
@@ -107,7 +234,8 @@ class LLMService(commands.Cog):
                     
         # 添加記憶上下文
         if self.chat_memory and channel_id:
-            memory_text = get_memory(channel_id)
+            if memory_text is None:
+                memory_text = await asyncio.to_thread(get_memory, channel_id)
             if memory_text:
                 prompt += f"""
                         ### 對話歷史：
@@ -129,7 +257,7 @@ class LLMService(commands.Cog):
                     
         try:
             # 獲取模型回應
-            response = self.gpt.get_response(prompt, temperature=0.5)
+            response = await self.gpt.get_response(prompt, temperature=0.5, model_name=self.router.fast_model(guild_id))
             if not response:
                 logger.error("[LLM] 模型回應為空")
                 return None
@@ -151,7 +279,7 @@ class LLMService(commands.Cog):
             # 執行搜索
             if result["search"] and result["query"]:
                 query = result["query"]
-                search_results = google_search(query)
+                search_results = await asyncio.to_thread(google_search, query)
                 return search_results
                 
             return None
@@ -170,7 +298,7 @@ class LLMService(commands.Cog):
         # 創建一個 Discord Embed 來顯示幫助信息
         embed = discord.Embed(
             title="🤖 機器人使用指南",
-            description="你可以使用以下兩種方式與我互動：\n1. 使用指令前綴 `!`\n2. 直接提及（@）我\n\n以下是所有可用的命令：",
+            description="你可以使用以下三種方式與我互動：\n1. 使用斜線命令 `/`\n2. 使用指令前綴 `!`\n3. 直接提及（@）我\n\n以下是所有可用的命令：",
             color=discord.Color.blue()
         )
         
@@ -184,10 +312,24 @@ class LLMService(commands.Cog):
             inline=False
         )
         
+        # 斜線命令
+        slash_commands = [
+            "`/ask <問題> [圖片]` - 向 AI 提問",
+            "`/memory show` / `/memory clear` - 顯示或清除當前頻道的對話歷史",
+            "`/personality show|set|channel|clear` - 查看或設定全局、頻道專屬個性"
+        ]
+        embed.add_field(
+            name="⌨️ 斜線命令",
+            value="\n".join(slash_commands),
+            inline=False
+        )
+        
         # 記憶相關命令
         memory_commands = [
             f"`{prefix}clear_memory` - 清除當前頻道的對話歷史",
-            f"`{prefix}show_memory` - 顯示當前的對話歷史"
+            f"`{prefix}show_memory` - 顯示當前的對話歷史",
+            f"`{prefix}memory_stats` - 顯示記憶與個性資料的用量統計",
+            f"`{prefix}prewarm_stats` - 顯示輸入中預熱的命中率"
         ]
         embed.add_field(
             name="🧠 記憶相關",
@@ -201,7 +343,8 @@ class LLMService(commands.Cog):
             f"`{prefix}set_personality <個性描述>` - 設定機器人的全局個性",
             f"`{prefix}set_channel_personality <個性描述>` - 設定當前頻道的專屬個性",
             f"`{prefix}clear_channel_personality` - 清除當前頻道的專屬個性",
-            f"`{prefix}show_prompts` - 顯示當前的系統提示和個性設定"
+            f"`{prefix}show_prompts` - 顯示當前的系統提示和個性設定",
+            f"`{prefix}response_cache [on|off]` - 設定當前頻道是否使用回應快取"
         ]
         embed.add_field(
             name="⚙️ 系統設定",
@@ -212,7 +355,7 @@ class LLMService(commands.Cog):
         # 機器人功能說明
         features = [
             "✅ **AI 對話**：使用 Google Gemini 1.5 Flash AI 模型",
-            "✅ **雙重互動**：支援指令前綴和提及（@）兩種方式",
+            "✅ **多種互動**：支援斜線命令、指令前綴和提及（@）",
             "✅ **記憶功能**：記住對話歷史，實現連貫對話",
             "✅ **個性設定**：可為機器人設定全局或頻道專屬的個性",
             "✅ **智能搜索**：問題涉及最新資訊時會自動搜索"
@@ -232,19 +375,9 @@ class LLMService(commands.Cog):
         
         用法: !set_system_prompt 你是一個友善的助手，請用繁體中文回答問題
         """
-        # 更新記憶體中的系統提示
-        self.system_prompt = prompt
-        
-        # 更新配置文件
-        config_path = os.path.join(PROJECT_ROOT, "config", "bot_config.json")
+        # 更新配置文件，設定服務會通知並更新記憶體中的系統提示
         try:
-            with open(config_path, "r", encoding="utf-8") as f:
-                config_data = json.load(f)
-            
-            config_data["system_prompt"] = prompt
-            
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config_data, f, ensure_ascii=False, indent=4)
+            await self.config.update(system_prompt=prompt)
                 
             await ctx.send(f"✅ 系統提示已更新為：\n```\n{prompt}\n```")
             logger.info(f"系統提示已更新，使用者：{ctx.author.name}，新提示：{prompt}")
@@ -252,40 +385,21 @@ class LLMService(commands.Cog):
             await ctx.send(f"❌ 更新系統提示時發生錯誤：{str(e)}")
             logger.error(f"更新系統提示失敗：{e}")
 
-    @commands.command(name="set_personality")
-    async def set_personality(self, ctx: commands.Context, *, personality: str) -> None:
-        """設定機器人的全局個性
-        
-        用法: !set_personality 你是一個幽默風趣的助手，喜歡用生動的比喻來解釋複雜概念
-        """
-        # 更新記憶體中的個性
-        self.personality = personality
-        
-        # 更新配置文件
-        config_path = os.path.join(PROJECT_ROOT, "config", "bot_config.json")
+    async def update_global_personality(self, personality: str, user_name: str) -> str:
+        """更新全局個性，回傳要發送的結果訊息"""
+        # 更新配置文件，設定服務會通知並更新記憶體中的個性
         try:
-            with open(config_path, "r", encoding="utf-8") as f:
-                config_data = json.load(f)
-            
-            config_data["personality"] = personality
-            
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config_data, f, ensure_ascii=False, indent=4)
-                
-            await ctx.send(f"✅ 全局個性已更新為：\n```\n{personality}\n```")
-            logger.info(f"全局個性已更新，使用者：{ctx.author.name}，新個性：{personality}")
+            await self.config.update(personality=personality)
+            logger.info(f"全局個性已更新，使用者：{user_name}，新個性：{personality}")
+            return f"✅ 全局個性已更新為：\n```\n{personality}\n```"
         except Exception as e:
-            await ctx.send(f"❌ 更新全局個性時發生錯誤：{str(e)}")
             logger.error(f"更新全局個性失敗：{e}")
+            return f"❌ 更新全局個性時發生錯誤：{str(e)}"
 
-    @commands.command(name="set_channel_personality")
-    async def set_channel_personality(self, ctx: commands.Context, *, personality: str) -> None:
-        """設定當前頻道的專屬個性
-        
-        用法: !set_channel_personality 在這個頻道中，你是一個專業的程式設計教師
-        """
-        channel_id = ctx.channel.id
-        channel_name = get_channel_name(ctx.channel)
+    async def update_channel_personality(self, channel, personality: str) -> str:
+        """寫入頻道專屬個性，回傳要發送的結果訊息"""
+        channel_id = channel.id
+        channel_name = get_channel_name(channel)
         file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
         
         try:
@@ -293,18 +407,33 @@ class LLMService(commands.Cog):
             os.makedirs(PERSONALITY_FOLDER, exist_ok=True)
             
             # 寫入頻道專屬個性
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump({"personality": personality}, f, ensure_ascii=False, indent=4)
-                
-            await ctx.send(f"✅ 已為頻道 `{channel_name}` 設定專屬個性：\n```\n{personality}\n```")
+            await asyncio.to_thread(atomic_write_json, file_path, {"personality": personality})
+            self.invalidate_prewarm(channel_id)
             logger.info(f"頻道個性已更新，頻道：{channel_name}，ID：{channel_id}，新個性：{personality}")
+            return f"✅ 已為頻道 `{channel_name}` 設定專屬個性：\n```\n{personality}\n```"
         except Exception as e:
-            await ctx.send(f"❌ 設定頻道個性時發生錯誤：{str(e)}")
             logger.error(f"設定頻道個性失敗：{e}")
+            return f"❌ 設定頻道個性時發生錯誤：{str(e)}"
 
-    @commands.command(name="show_prompts")
-    async def show_prompts(self, ctx: commands.Context) -> None:
-        """顯示當前的系統提示和個性設定"""
+    def reset_channel_personality(self, channel) -> str:
+        """清除頻道專屬個性，回傳要發送的結果訊息"""
+        channel_id = channel.id
+        channel_name = get_channel_name(channel)
+        file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
+        
+        if not os.path.exists(file_path):
+            return f"ℹ️ 頻道 `{channel_name}` 沒有專屬個性設定"
+        try:
+            os.remove(file_path)
+            self.invalidate_prewarm(channel_id)
+            logger.info(f"已清除頻道個性，頻道：{channel_name}，ID：{channel_id}")
+            return f"✅ 已清除頻道 `{channel_name}` 的專屬個性設定"
+        except Exception as e:
+            logger.error(f"清除頻道個性失敗：{e}")
+            return f"❌ 清除頻道個性時發生錯誤：{str(e)}"
+
+    def prompts_embed(self, channel) -> discord.Embed:
+        """構建顯示系統提示和個性設定的 embed"""
         # 獲取系統提示
         system_prompt = self.system_prompt or "未設定"
         
@@ -312,8 +441,8 @@ class LLMService(commands.Cog):
         global_personality = self.personality or "未設定"
         
         # 獲取頻道個性
-        channel_id = ctx.channel.id
-        channel_name = get_channel_name(ctx.channel)
+        channel_id = channel.id
+        channel_name = get_channel_name(channel)
         file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
         channel_personality = "未設定"
         
@@ -349,26 +478,331 @@ class LLMService(commands.Cog):
             value=f"```\n{channel_personality}\n```",
             inline=False
         )
+        return embed
+
+    @commands.command(name="set_personality")
+    async def set_personality(self, ctx: commands.Context, *, personality: str) -> None:
+        """設定機器人的全局個性
         
-        await ctx.send(embed=embed)
+        用法: !set_personality 你是一個幽默風趣的助手，喜歡用生動的比喻來解釋複雜概念
+        """
+        await ctx.send(await self.update_global_personality(personality, ctx.author.name))
+
+    @commands.command(name="set_channel_personality")
+    async def set_channel_personality(self, ctx: commands.Context, *, personality: str) -> None:
+        """設定當前頻道的專屬個性
+        
+        用法: !set_channel_personality 在這個頻道中，你是一個專業的程式設計教師
+        """
+        await ctx.send(await self.update_channel_personality(ctx.channel, personality))
+
+    @commands.command(name="show_prompts")
+    async def show_prompts(self, ctx: commands.Context) -> None:
+        """顯示當前的系統提示和個性設定"""
+        await ctx.send(embed=self.prompts_embed(ctx.channel))
 
     @commands.command(name="clear_channel_personality")
     async def clear_channel_personality(self, ctx: commands.Context) -> None:
         """清除當前頻道的專屬個性設定"""
+        await ctx.send(self.reset_channel_personality(ctx.channel))
+
+    # Discord 只能對整個頂層命令設定預設權限，子命令無法個別設定
+    personality_group = app_commands.Group(name="personality", description="查看或設定機器人的個性",
+                                           default_permissions=discord.Permissions(manage_guild=True))
+
+    @personality_group.command(name="show", description="顯示當前的系統提示和個性設定")
+    async def personality_show(self, interaction: discord.Interaction) -> None:
+        await interaction.response.defer(thinking=True)
+        await interaction.followup.send(embed=self.prompts_embed(interaction.channel))
+
+    @personality_group.command(name="set", description="設定機器人的全局個性")
+    @app_commands.describe(personality="個性描述")
+    async def personality_set(self, interaction: discord.Interaction, personality: str) -> None:
+        await interaction.response.defer(thinking=True)
+        await interaction.followup.send(await self.update_global_personality(personality, interaction.user.name))
+
+    @personality_group.command(name="channel", description="設定當前頻道的專屬個性")
+    @app_commands.describe(personality="個性描述")
+    async def personality_channel(self, interaction: discord.Interaction, personality: str) -> None:
+        await interaction.response.defer(thinking=True)
+        await interaction.followup.send(await self.update_channel_personality(interaction.channel, personality))
+
+    @personality_group.command(name="clear", description="清除當前頻道的專屬個性")
+    async def personality_clear(self, interaction: discord.Interaction) -> None:
+        await interaction.response.defer(thinking=True)
+        await interaction.followup.send(self.reset_channel_personality(interaction.channel))
+
+    def load_context(self, channel_id: int) -> PrewarmedContext:
+        """載入頻道的記憶、個性並構建提示詞前段"""
+        # 先取得版本再讀取記憶，讀取期間有寫入時版本必定不同
+        version = memory_version(channel_id)
+        memory = get_memory(channel_id) if self.chat_memory else None
+        personality = self.get_channel_personality(channel_id)
+        if self.prewarm_model:
+            self.gpt.warm_model(self.router.fast_model())
+        return PrewarmedContext(
+            memory=memory,
+            personality=personality,
+            prompt_prefix=get_prompt_prefix(self.system_prompt, personality, memory),
+            memory_version=version,
+            expires_at=time.monotonic() + self.prewarm_ttl,
+        )
+
+    def evict_expired_prewarm(self) -> None:
+        """清除過期的預熱狀態，避免沒有提問的頻道一直佔用記憶體"""
+        now = time.monotonic()
+        for channel_id in [cid for cid, context in self.prewarmed.items() if context.expires_at <= now]:
+            del self.prewarmed[channel_id]
+
+    def take_prewarmed(self, channel_id: int) -> Optional[PrewarmedContext]:
+        """取出仍有效的預熱狀態，並統計命中率
+
+        記憶在預熱後被寫入、壓縮或刪除（包括清除記憶與定期清理）時，預熱的內容視為過期。
+        """
+        self.evict_expired_prewarm()
+        context = self.prewarmed.pop(channel_id, None)
+        if context is not None and context.memory_version != memory_version(channel_id):
+            context = None
+        # 停用預熱時不統計，避免命中率被拉低
+        if self.prewarm_enabled:
+            if context is not None:
+                self.prewarm_hits += 1
+            else:
+                self.prewarm_misses += 1
+        return context
+
+    def invalidate_prewarm(self, channel_id: Optional[int] = None) -> None:
+        """清除預熱狀態（未指定頻道時清除全部）"""
+        if channel_id is None:
+            self.prewarmed.clear()
+        else:
+            self.prewarmed.pop(channel_id, None)
+
+    async def prewarm(self, channel_id: int) -> None:
+        try:
+            self.prewarmed[channel_id] = await asyncio.to_thread(self.load_context, channel_id)
+        except Exception as e:
+            logger.error(f"[LLM] 預熱頻道 {channel_id} 失敗: {e}")
+        finally:
+            self.prewarming.pop(channel_id, None)
+
+    async def generate_reply(self, channel_id: int, user_nick: str, text: str, guild_id=None,
+                             attachments: Sequence[discord.Attachment] = ()) -> Optional[str]:
+        """下載附件、搜索、讀取記憶並生成回應，成功時寫入記憶
+
+        Gemini 呼叫使用非同步 API，請求被取消時會中止進行中的呼叫，且不會寫入記憶。
+        """
+        images = await self.attachments.prepare(attachments) if attachments else []
+
+        # 優先使用輸入中預熱的頻道狀態
+        context = self.take_prewarmed(channel_id)
+        if context is None:
+            context = await asyncio.to_thread(self.load_context, channel_id)
+        memory = context.memory
+
+        # 獲取搜索結果
+        search_results = None
+        if self.use_search_engine:
+            search_results = await self.get_search_results(text, channel_id, guild_id, memory or "")
+
+        # 生成回應
+        if (not self.chat_memory and not self.use_search_engine and not images
+                and self.response_cache.applies_to(channel_id)):
+            response = await self.get_cached_response(channel_id, user_nick, text, guild_id, context.prompt_prefix)
+        else:
+            response = await self.get_response(
+                channel_id, user_nick, text, search_results, memory, guild_id, context.prompt_prefix, images
+            )
+        if not response or response.startswith("[Gemini 錯誤]"):
+            return response
+
+        # 保存記憶
+        if self.chat_memory:
+            search_results_str = search_results if search_results is not None else ""
+            # 寫入可能需要等待維護執行緒持有的頻道鎖或改寫整個檔案，在執行緒中進行；
+            # 寫入會更新記憶版本，先前預熱的內容因此失效
+            await asyncio.to_thread(save_memory, channel_id, user_nick, text, search_results_str, response)
+            self.invalidate_prewarm(channel_id)
+
+        return response
+
+    async def run_request(self, message_id: int, coro: Awaitable[Optional[str]]) -> Optional[str]:
+        """以訊息 ID 登記進行中的生成，並套用端到端截止時間
+
+        被取消時拋出 RequestCancelled，逾時則拋出 asyncio.TimeoutError。
+        """
+        task = asyncio.ensure_future(coro)
+        self.inflight[message_id] = task
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.request_timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self.inflight.get(message_id) is task:
+                del self.inflight[message_id]
+
+        if not done:
+            task.cancel()
+            raise asyncio.TimeoutError()
+        if task.cancelled():
+            raise RequestCancelled()
+        return task.result()
+
+    def cancel_request(self, message_id: int) -> bool:
+        """取消指定訊息進行中的生成"""
+        task = self.inflight.get(message_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def answer(self, request_id: int, guild_id, channel_id: int, author, text: str,
+                     attachments: Sequence = ()) -> Optional[str]:
+        """排程並生成回應，回傳要發送的文字（含錯誤提示）；請求被取消時回傳 None"""
+        user_nick = author.display_name
+        try:
+            response = await self.run_request(request_id, self.scheduler.submit(
+                guild_id, channel_id,
+                lambda: self.generate_reply(channel_id, user_nick, text, guild_id, attachments)
+            ))
+        except RequestCancelled:
+            llm_logger.info("[LLM] 請求已取消，請求 ID: {}", request_id)
+            return None
+        except asyncio.TimeoutError:
+            logger.warning(f"[LLM] 回應逾時（{self.request_timeout} 秒），伺服器 ID: {guild_id}, 使用者: {author.name}")
+            return "⏱️ 抱歉，回應時間過長，請稍後再試。"
+        except Exception as e:
+            # 任何未預期的錯誤都要回覆，否則延遲的斜線命令會一直顯示「思考中」
+            logger.exception(f"[LLM] 生成回應時發生錯誤，伺服器 ID: {guild_id}, 使用者: {author.name}: {e}")
+            return "抱歉，我遇到了一些問題：生成回應時發生錯誤"
+
+        # 檢查回應是否有效
+        if not response:
+            error_msg = "無法生成回應"
+            logger.error(f"[LLM] {error_msg}，伺服器 ID: {guild_id}, 使用者: {author.name}, 輸入: {text[:50]}...")
+            return f"抱歉，我遇到了一些問題：{error_msg}"
+
+        # 檢查是否為錯誤回應
+        if response.startswith("[Gemini 錯誤]"):
+            logger.error(f"[LLM] {response}，伺服器 ID: {guild_id}, 使用者: {author.name}, 輸入: {text[:50]}...")
+            return f"抱歉，我遇到了一些問題：{response}"
+
+        # 記錄日誌
+        llm_logger.opt(lazy=True).info(
+            "[LLM] 伺服器 ID: {}, 使用者: {}, 輸入: {}..., 輸出: {}...",
+            lambda: guild_id, lambda: author.name, lambda: text[:50], lambda: response[:50]
+        )
+        return response
+
+    async def handle_request(self, ctx: commands.Context, text: str) -> None:
+        """處理一則提問並發送回應"""
+        with logger.contextualize(request_id=new_request_id()):
+            guild_id = ctx.guild.id if ctx.guild else 'DM'
+            async with ctx.typing():
+                reply = await self.answer(ctx.message.id, guild_id, ctx.channel.id, ctx.author,
+                                          text, ctx.message.attachments)
+            if reply is None:
+                return
+
+            # 依 Markdown 分段發送長回應，過長時改以檔案發送
+            await outbound.send_text(ctx.channel, reply)
+
+    @app_commands.command(name="ask", description="向 AI 提問（具有上下文記憶）")
+    @app_commands.describe(question="想問的問題", image="附加一張圖片（可選）")
+    async def ask_slash(self, interaction: discord.Interaction, question: str,
+                        image: Optional[discord.Attachment] = None) -> None:
+        """斜線命令版本的提問"""
+        # 斜線命令不經過 on_message，需要自行套用頻道允許清單
+        message_filter = getattr(self.bot, "message_filter", None)
+        if message_filter is not None and not message_filter.channel_allowed_in(interaction.guild, interaction.channel):
+            await interaction.response.send_message("❌ 此頻道未開放使用機器人", ephemeral=True)
+            return
+        # Discord 要求在 3 秒內確認互動，先延遲回應，生成完成後再以後續訊息發送
+        await interaction.response.defer(thinking=True)
+        with logger.contextualize(request_id=new_request_id()):
+            guild_id = interaction.guild_id or 'DM'
+            reply = await self.answer(interaction.id, guild_id, interaction.channel_id, interaction.user,
+                                      question, [image] if image else ())
+            # 延遲的互動必須有後續訊息，否則會一直顯示「思考中」
+            await outbound.send_text(interaction.followup, reply or "ℹ️ 請求已取消",
+                                     channel_id=interaction.channel_id)
+
+    @commands.Cog.listener()
+    async def on_typing(self, channel: discord.abc.Messageable, user, when) -> None:
+        """使用者開始輸入時，預先載入頻道狀態"""
+        if not self.prewarm_enabled or user.bot:
+            return
+        # 不預熱允許清單以外的頻道，機器人不會在那裡回應
+        message_filter = getattr(self.bot, "message_filter", None)
+        if message_filter is not None and not message_filter.channel_allowed_in(getattr(channel, "guild", None), channel):
+            return
+        self.evict_expired_prewarm()
+        channel_id = channel.id
+        context = self.prewarmed.get(channel_id)
+        if context is not None and context.expires_at > time.monotonic():
+            return
+        if channel_id in self.prewarming or len(self.prewarming) >= self.prewarm_max_concurrent:
+            return
+        self.prewarming[channel_id] = asyncio.ensure_future(self.prewarm(channel_id))
+
+    @commands.command(name="response_cache")
+    async def response_cache_command(self, ctx: commands.Context, action: Optional[str] = None) -> None:
+        """設定當前頻道是否使用回應快取，或顯示快取統計
+
+        用法: !response_cache off / !response_cache on / !response_cache
+        """
         channel_id = ctx.channel.id
-        channel_name = get_channel_name(ctx.channel)
-        file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
-        
-        if os.path.exists(file_path):
+        settings = dict(self.config.snapshot.get("response_cache", {}))
+        disabled = set(settings.get("disabled_channels", []))
+
+        if action in ("on", "off"):
+            if action == "off":
+                disabled.add(channel_id)
+            else:
+                disabled.discard(channel_id)
+            settings["disabled_channels"] = sorted(disabled)
             try:
-                os.remove(file_path)
-                await ctx.send(f"✅ 已清除頻道 `{channel_name}` 的專屬個性設定")
-                logger.info(f"已清除頻道個性，頻道：{channel_name}，ID：{channel_id}")
+                await self.config.update(response_cache=settings)
+                await ctx.send(f"✅ 此頻道已{'停用' if action == 'off' else '啟用'}回應快取")
             except Exception as e:
-                await ctx.send(f"❌ 清除頻道個性時發生錯誤：{str(e)}")
-                logger.error(f"清除頻道個性失敗：{e}")
-        else:
-            await ctx.send(f"ℹ️ 頻道 `{channel_name}` 沒有專屬個性設定")
+                await ctx.send(f"❌ 更新回應快取設定時發生錯誤：{str(e)}")
+                logger.error(f"更新回應快取設定失敗：{e}")
+            return
+
+        cache = self.response_cache
+        total = cache.hits + cache.misses
+        rate = cache.hits / total * 100 if total else 0.0
+        status = "啟用" if cache.applies_to(channel_id) else "停用"
+        await ctx.send(
+            f"回應快取（此頻道{status}）：{len(cache.entries)} 筆，"
+            f"命中率 {rate:.1f}%（命中 {cache.hits} 次 / 共 {total} 次）"
+        )
+
+    @commands.command(name="prewarm_stats")
+    async def prewarm_stats(self, ctx: commands.Context) -> None:
+        """顯示輸入中預熱的命中率"""
+        total = self.prewarm_hits + self.prewarm_misses
+        rate = self.prewarm_hits / total * 100 if total else 0.0
+        await ctx.send(f"預熱命中率：{rate:.1f}%（命中 {self.prewarm_hits} 次 / 共 {total} 次）")
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message: discord.Message) -> None:
+        """訊息被刪除時，取消對應的生成"""
+        if self.cancel_request(message.id):
+            llm_logger.info("[LLM] 訊息已刪除，取消生成，訊息 ID: {}", message.id)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message) -> None:
+        """訊息被編輯時，取消對應的生成，並依設定重新生成"""
+        if before.content == after.content:
+            return
+        if not self.cancel_request(after.id):
+            return
+
+        llm_logger.info("[LLM] 訊息已編輯，取消生成，訊息 ID: {}", after.id)
+        if self.edit_action == "regenerate":
+            await self.bot.process_commands(after)
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: commands.Context, error: Exception) -> None:
@@ -380,48 +814,8 @@ class LLMService(commands.Cog):
         user_input = ctx.message.content[len(ctx.prefix):].strip()
         if not user_input:
             return
-            
-        async with ctx.typing():
-            # 基本資訊
-            channel_id = ctx.channel.id
-            user_nick = ctx.author.display_name
-            guild_id = ctx.guild.id if ctx.guild else 'DM'
-            
-            # 獲取搜索結果
-            search_results = None
-            if self.use_search_engine:
-                search_results = self.get_search_results(user_input, channel_id)
-            
-            # 獲取記憶
-            memory = None
-            if self.chat_memory:
-                memory = get_memory(channel_id)
-            
-            # 生成回應
-            response = self.get_response(channel_id, user_nick, user_input, search_results, memory)
-            
-            # 保存記憶
-            if self.chat_memory and response:
-                search_results_str = search_results if search_results is not None else ""
-                save_memory(channel_id, user_nick, user_input, search_results_str, response)
-            
-            # 記錄日誌
-            if response:
-                logger.info(f"[LLM] 伺服器 ID: {guild_id}, 使用者: {ctx.author.name}, 輸入: {user_input[:50]}..., 輸出: {response[:50]}...")
-                
-                # 發送回應
-                response_str = str(response) if response is not None else "無回應"
-                
-                # 確保 response_str 不為 None 再使用 len()
-                if response_str and len(response_str) > 1900:
-                    chunks = [response_str[i:i+1900] for i in range(0, len(response_str), 1900)]
-                    for chunk in chunks:
-                        await ctx.send(chunk)
-                else:
-                    await ctx.send(response_str)
-            else:
-                logger.error(f"[LLM] 無法生成回應，伺服器 ID: {guild_id}, 使用者: {ctx.author.name}, 輸入: {user_input[:50]}...")
-                await ctx.send("抱歉..我無法處理這個訊息。")
+
+        await self.handle_request(ctx, user_input)
 
     @commands.command(name="YTC")
     async def ytc_command(self, ctx: commands.Context, *, prompt: str) -> None:
@@ -429,53 +823,7 @@ class LLMService(commands.Cog):
         
         用法: !YTC 你好，請介紹一下自己
         """
-        async with ctx.typing():
-            # 基本資訊
-            channel_id = ctx.channel.id
-            user_nick = ctx.author.display_name
-            guild_id = ctx.guild.id if ctx.guild else 'DM'
-            
-            # 獲取搜索結果
-            search_results = None
-            if self.use_search_engine:
-                search_results = self.get_search_results(prompt, channel_id)
-            
-            # 獲取記憶
-            memory = None
-            if self.chat_memory:
-                memory = get_memory(channel_id)
-            
-            # 生成回應
-            response = self.get_response(channel_id, user_nick, prompt, search_results, memory)
-            
-            # 檢查回應是否有效
-            if not response:
-                error_msg = "無法生成回應"
-                logger.error(f"[LLM] {error_msg}，伺服器 ID: {guild_id}, 使用者: {ctx.author.name}, 輸入: {prompt[:50]}...")
-                await ctx.send(f"抱歉，我遇到了一些問題：{error_msg}")
-                return
-                
-            # 檢查是否為錯誤回應
-            if response.startswith("[Gemini 錯誤]"):
-                logger.error(f"[LLM] {response}，伺服器 ID: {guild_id}, 使用者: {ctx.author.name}, 輸入: {prompt[:50]}...")
-                await ctx.send(f"抱歉，我遇到了一些問題：{response}")
-                return
-            
-            # 保存記憶
-            if self.chat_memory:
-                search_results_str = search_results if search_results is not None else ""
-                save_memory(channel_id, user_nick, prompt, search_results_str, response)
-            
-            # 記錄日誌
-            logger.info(f"[LLM] 伺服器 ID: {guild_id}, 使用者: {ctx.author.name}, 輸入: {prompt[:50]}..., 輸出: {response[:50]}...")
-            
-            # 分段發送長回應
-            if len(response) > 1900:
-                chunks = [response[i:i+1900] for i in range(0, len(response), 1900)]
-                for chunk in chunks:
-                    await ctx.send(chunk)
-            else:
-                await ctx.send(response)
+        await self.handle_request(ctx, prompt)
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(LLMService(bot)) 
\ No newline at end of file
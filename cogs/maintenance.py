@@ -0,0 +1,162 @@
+import os
+import time
+import asyncio
+import discord
+from typing import Iterable
+from loguru import logger
+from discord.ext import commands, tasks
+from cogs.llm import PERSONALITY_FOLDER
+from cogs.memory import MEMORY_PATH, delete_memory, compact_memory, directory_usage
+from config.config import BotConfig, config
+from utils import memory_store
+
+class Maintenance(commands.Cog, name="Maintenance"):
+    """定期清理記憶與個性資料夾"""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.config = config
+        self.apply_settings(self.config.snapshot)
+
+        # 最近一次清理的統計，供查詢時使用，不需要重新掃描目錄
+        self.stats = {
+            "memory_files": 0,
+            "memory_bytes": 0,
+            "personality_files": 0,
+            "personality_bytes": 0,
+            "expired": 0,
+            "compacted": 0,
+            "purged": 0,
+            "last_run": None,
+        }
+
+        self.sweep.start()
+        self.config.subscribe(self.on_config_change)
+        logger.info(f"功能 {self.__class__.__name__} 初始化載入成功！")
+
+    def cog_unload(self) -> None:
+        self.config.unsubscribe(self.on_config_change)
+        self.sweep.cancel()
+
+    def apply_settings(self, snapshot: BotConfig) -> None:
+        settings = snapshot.get("maintenance", {})
+        self.interval_hours = settings.get("interval_hours", 6)
+        self.memory_ttl_days = settings.get("memory_ttl_days", 30)
+        self.max_memory_bytes = settings.get("max_memory_bytes", 256 * 1024)
+        self.compact_keep = settings.get("compact_keep", 20)
+        self.sweep.change_interval(hours=self.interval_hours)
+
+    def on_config_change(self, old: BotConfig, new: BotConfig) -> None:
+        self.apply_settings(new)
+
+    def run_sweep(self) -> dict:
+        """清除閒置過久的記憶、壓縮過大的記憶檔案並統計用量"""
+        now = time.time()
+        ttl_seconds = self.memory_ttl_days * 86400
+        expired = 0
+        compacted = 0
+        memory_files = 0
+        memory_bytes = 0
+
+        if os.path.exists(MEMORY_PATH):
+            with os.scandir(MEMORY_PATH) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    channel_id, ext = os.path.splitext(entry.name)
+                    stat = entry.stat()
+
+                    # 索引檔與暫存檔由對應的資料檔一併處理
+                    if ext not in (memory_store.DATA_EXT, memory_store.LEGACY_EXT):
+                        continue
+
+                    if ttl_seconds > 0 and now - stat.st_mtime > ttl_seconds:
+                        if delete_memory(channel_id):
+                            expired += 1
+                            continue
+
+                    if self.max_memory_bytes > 0 and stat.st_size > self.max_memory_bytes:
+                        if compact_memory(channel_id, self.compact_keep):
+                            compacted += 1
+
+                    memory_files += 1
+                    memory_bytes += memory_store.disk_usage(os.path.join(MEMORY_PATH, channel_id))
+
+        personality_files, personality_bytes = directory_usage(PERSONALITY_FOLDER)
+        return {
+            "memory_files": memory_files,
+            "memory_bytes": memory_bytes,
+            "personality_files": personality_files,
+            "personality_bytes": personality_bytes,
+            "expired": expired,
+            "compacted": compacted,
+        }
+
+    def purge_channels(self, channel_ids: Iterable[int]) -> int:
+        """刪除指定頻道的記憶與個性檔案，回傳刪除的檔案數"""
+        removed = 0
+        for channel_id in channel_ids:
+            if delete_memory(channel_id):
+                removed += 1
+            file_path = os.path.join(PERSONALITY_FOLDER, f"{channel_id}.json")
+            try:
+                os.remove(file_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"[維護] 刪除個性檔案失敗: {e}")
+        return removed
+
+    async def purge(self, channel_ids: Iterable[int]) -> None:
+        removed = await asyncio.to_thread(self.purge_channels, list(channel_ids))
+        self.stats["purged"] += removed
+        if removed:
+            logger.info(f"[維護] 已刪除 {removed} 個已離開頻道的資料檔案")
+
+    @tasks.loop(hours=6)
+    async def sweep(self) -> None:
+        try:
+            result = await asyncio.to_thread(self.run_sweep)
+        except Exception as e:
+            logger.error(f"[維護] 定期清理失敗: {e}")
+            return
+
+        self.stats.update(result)
+        self.stats["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        logger.info(
+            f"[維護] 清理完成：過期 {result['expired']} 個、壓縮 {result['compacted']} 個，"
+            f"記憶 {result['memory_files']} 個檔案 / {result['memory_bytes']} 字節"
+        )
+
+    @sweep.before_loop
+    async def before_sweep(self) -> None:
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        """機器人離開伺服器時，刪除該伺服器所有頻道的資料"""
+        channel_ids = [channel.id for channel in guild.channels] + [thread.id for thread in guild.threads]
+        await self.purge(channel_ids)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> None:
+        """頻道被刪除時，刪除該頻道的資料"""
+        await self.purge([channel.id])
+
+    @commands.command(name="memory_stats")
+    async def memory_stats(self, ctx: commands.Context) -> None:
+        """顯示最近一次清理時的資料用量統計"""
+        stats = self.stats
+        embed = discord.Embed(title="資料用量統計", color=discord.Color.blue())
+        embed.add_field(name="記憶檔案", value=f"{stats['memory_files']} 個 / {stats['memory_bytes']} 字節", inline=False)
+        embed.add_field(name="個性檔案", value=f"{stats['personality_files']} 個 / {stats['personality_bytes']} 字節", inline=False)
+        embed.add_field(
+            name="清理紀錄",
+            value=f"過期 {stats['expired']} 個、壓縮 {stats['compacted']} 個、已離開頻道 {stats['purged']} 個",
+            inline=False
+        )
+        embed.set_footer(text=f"最近一次清理：{stats['last_run'] or '尚未執行'}")
+        await ctx.send(embed=embed)
+
+async def setup(bot: commands.Bot) -> None:
+    await bot.add_cog(Maintenance(bot))
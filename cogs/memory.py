@@ -2,46 +2,83 @@ import os
 import json
 import datetime
 from loguru import logger
+import discord
+from discord import app_commands
 from discord.ext import commands
 from collections import defaultdict, deque
 import time
+import asyncio
+import threading
+from utils import memory_store
+from utils.outbound import outbound
 
 MEMORY_PATH = "assets/data/memory"
+# 高頻記憶日誌使用獨立類別，方便在日誌設定中抽樣
+memory_logger = logger.bind(category="memory")
 os.makedirs(MEMORY_PATH, exist_ok=True)
 
+# 頻道 ID -> 記憶檔案的鎖；寫入在事件迴圈中進行，讀取與壓縮則可能在執行緒中進行
+_channel_locks = {}
+_channel_locks_guard = threading.Lock()
+# 頻道 ID -> 記憶版本；每次寫入、壓縮或刪除時遞增，讓預先載入的記憶可以判斷是否過期
+_memory_versions = {}
+
+def memory_base(channel_id):
+    """頻道記憶檔案的路徑（不含副檔名）"""
+    return os.path.join(MEMORY_PATH, str(channel_id))
+
+def channel_lock(channel_id) -> threading.Lock:
+    """取得頻道記憶檔案的鎖，讀取、附加、改寫與刪除都必須持有"""
+    key = str(channel_id)
+    with _channel_locks_guard:
+        lock = _channel_locks.get(key)
+        if lock is None:
+            lock = _channel_locks[key] = threading.Lock()
+        return lock
+
+def memory_version(channel_id) -> int:
+    """頻道記憶目前的版本，應在讀取記憶之前取得"""
+    return _memory_versions.get(str(channel_id), 0)
+
+def _bump_version(channel_id) -> None:
+    # 必須在持有頻道鎖時呼叫
+    key = str(channel_id)
+    _memory_versions[key] = _memory_versions.get(key, 0) + 1
+
+def format_memories(memories):
+    memory_str = ""
+    for memory in memories:
+        memory_str += f"使用者：{memory['使用者']}\n"
+        memory_str += f"使用者輸入：{memory['使用者輸入']}\n"
+        if memory['參考資料']:
+            memory_str += f"參考資料：{memory['參考資料']}\n"
+        memory_str += f"機器人回覆：{memory['機器人回覆']}\n"
+        memory_str += f"時間：{memory['時間']}\n\n"
+    return memory_str
+
 def get_memory(channel_id, num_memories=5):
-    file_path = os.path.join(MEMORY_PATH, f"{channel_id}.json")
-    if not os.path.exists(file_path):
-        return None
-    
+    base = memory_base(channel_id)
     try:
-        with open(file_path, 'r', encoding='utf-8-sig') as f:
-            memories = json.load(f)
-            memories = memories[-num_memories:] if memories else []
-            memory_str = ""
-            for memory in memories:
-                memory_str += f"使用者：{memory['使用者']}\n"
-                memory_str += f"使用者輸入：{memory['使用者輸入']}\n"
-                if memory['參考資料']:
-                    memory_str += f"參考資料：{memory['參考資料']}\n"
-                memory_str += f"機器人回覆：{memory['機器人回覆']}\n"
-                memory_str += f"時間：{memory['時間']}\n\n"
-            return memory_str
+        with channel_lock(channel_id):
+            # 二進位格式只讀取索引尾端的紀錄
+            if memory_store.exists(base):
+                return format_memories(memory_store.read_tail(base, num_memories))
+
+            # 相容尚未轉換的 JSON 記憶檔
+            file_path = base + memory_store.LEGACY_EXT
+            if not os.path.exists(file_path):
+                return None
+            with open(file_path, 'r', encoding='utf-8-sig') as f:
+                memories = json.load(f)
+                memories = memories[-num_memories:] if memories else []
+                return format_memories(memories)
 
     except Exception as e:
         logger.error(f"[記憶] 讀取時發生錯誤: {e}")
         return None
 
 def save_memory(channel_id, user_nick, user_input, search_results, response, max_memories=100):
-    file_path = os.path.join(MEMORY_PATH, f"{channel_id}.json")
-    memories = []
-    
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r', encoding='utf-8-sig') as f:
-                memories = json.load(f)
-        except Exception as e:
-            logger.error(f"[記憶] 讀取時發生錯誤: {e}")
+    base = memory_base(channel_id)
     
     # 紀錄記憶
     new_memory = {
@@ -51,18 +88,63 @@ def save_memory(channel_id, user_nick, user_input, search_results, response, max
         "機器人回覆": response,
         "時間": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
-    memories.append(new_memory)
-    
-    # 只保留最新的 max_memories 筆資料
-    if len(memories) > max_memories:
-        memories = memories[-max_memories:]
     
-    # 儲存記憶
+    with channel_lock(channel_id):
+        # 舊的 JSON 記憶檔在第一次寫入時轉換
+        if not memory_store.exists(base):
+            try:
+                memory_store.convert_legacy(base)
+            except Exception as e:
+                logger.error(f"[記憶] 轉換舊記憶檔時發生錯誤: {e}")
+
+        # 儲存記憶
+        _bump_version(channel_id)
+        try:
+            count = memory_store.append_record(base, new_memory)
+            # 累積到兩倍上限時才改寫，只保留最新的 max_memories 筆資料
+            if count > max_memories * 2:
+                memory_store.write_records(base, memory_store.read_tail(base, max_memories))
+        except Exception as e:
+            logger.error(f"[記憶] 儲存失敗: {e}")
+
+def delete_memory(channel_id) -> bool:
+    """刪除頻道的記憶檔案，回傳是否有刪除"""
     try:
-        with open(file_path, 'w', encoding='utf-8-sig') as f:
-            json.dump(memories, f, ensure_ascii=False, indent=2)
+        with channel_lock(channel_id):
+            _bump_version(channel_id)
+            return memory_store.delete(memory_base(channel_id))
+    except Exception as e:
+        logger.error(f"[記憶] 刪除失敗: {e}")
+        return False
+
+def compact_memory(channel_id, keep=20) -> bool:
+    """只保留最新的 keep 筆記憶以縮小檔案，回傳是否有改寫"""
+    base = memory_base(channel_id)
+    try:
+        # 與 save_memory 共用頻道鎖，避免附加寫入的偏移落在改寫後的索引中
+        with channel_lock(channel_id):
+            memory_store.convert_legacy(base)
+            if memory_store.count_records(base) <= keep:
+                return False
+            _bump_version(channel_id)
+            memory_store.write_records(base, memory_store.read_tail(base, keep))
+            return True
     except Exception as e:
-        logger.error(f"[記憶] 儲存失敗: {e}")
+        logger.error(f"[記憶] 壓縮失敗: {e}")
+        return False
+
+def directory_usage(path):
+    """統計目錄中的檔案數與總大小（不列出檔名）"""
+    count = 0
+    total = 0
+    if not os.path.exists(path):
+        return count, total
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                count += 1
+                total += entry.stat().st_size
+    return count, total
 
 class Memory(commands.Cog, name="Memory"):
     def __init__(self, bot):
@@ -97,7 +179,7 @@ class Memory(commands.Cog, name="Memory"):
                     user_nick = self.get_user_nick(user_id)
                     save_memory(channel_id, user_nick, last_user_message, "", content)
             
-            logger.info(f"已添加消息到歷史: user_id={user_id}, channel_id={channel_id}, role={role}, 內容長度={len(content)}")
+            memory_logger.info("已添加消息到歷史: user_id={}, channel_id={}, role={}, 內容長度={}", user_id, channel_id, role, len(content))
         except Exception as e:
             logger.error(f"添加消息失敗: {e}")
             import traceback
@@ -117,20 +199,20 @@ class Memory(commands.Cog, name="Memory"):
         try:
             # 從記憶體中獲取對話歷史
             history = list(self.conversation_history[user_id][channel_id])
-            logger.info(f"從記憶體獲取歷史記錄: user_id={user_id}, channel_id={channel_id}, 記錄數={len(history)}")
+            memory_logger.info("從記憶體獲取歷史記錄: user_id={}, channel_id={}, 記錄數={}", user_id, channel_id, len(history))
             
             if not history:
                 # 如果記憶體中沒有歷史記錄，嘗試從檔案中加載
                 file_memory = get_memory(channel_id)
                 if file_memory:
-                    logger.info(f"從檔案中加載了記憶: channel_id={channel_id}, 長度={len(file_memory)}")
+                    memory_logger.info("從檔案中加載了記憶: channel_id={}, 長度={}", channel_id, len(file_memory))
                     # 將檔案記憶添加為系統消息
                     return [{
                         "role": "model",
                         "parts": [{"text": "以下是之前的對話記錄，請參考：\n\n" + file_memory}]
                     }]
                 else:
-                    logger.info("沒有歷史記錄，返回空列表")
+                    memory_logger.info("沒有歷史記錄，返回空列表")
                     return []
                 
             # 格式化為 Gemini API 需要的格式
@@ -143,7 +225,7 @@ class Memory(commands.Cog, name="Memory"):
                     }
                     formatted_context.append(formatted_msg)
             
-            logger.info(f"返回格式化上下文，長度: {len(formatted_context)}")
+            memory_logger.info("返回格式化上下文，長度: {}", len(formatted_context))
             return formatted_context
         except Exception as e:
             logger.error(f"獲取對話上下文失敗: {e}")
@@ -151,7 +233,7 @@ class Memory(commands.Cog, name="Memory"):
             traceback.print_exc()
             return []
     
-    def clear_user_history(self, user_id, channel_id=None):
+    async def clear_user_history(self, user_id, channel_id=None):
         """清除特定用戶的對話歷史"""
         try:
             # 清除記憶體中的歷史
@@ -160,14 +242,9 @@ class Memory(commands.Cog, name="Memory"):
                     self.conversation_history[user_id][channel_id].clear()
                     logger.info(f"已清除用戶 {user_id} 在頻道 {channel_id} 的記憶體歷史記錄")
                 
-                # 清除檔案中的歷史
-                file_path = os.path.join(MEMORY_PATH, f"{channel_id}.json")
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"已刪除頻道 {channel_id} 的檔案歷史記錄: {file_path}")
-                    except Exception as e:
-                        logger.error(f"刪除檔案失敗: {e}")
+                # 清除檔案中的歷史（在執行緒中進行，等待頻道鎖時不阻塞事件迴圈）
+                if await asyncio.to_thread(delete_memory, channel_id):
+                    logger.info(f"已刪除頻道 {channel_id} 的檔案歷史記錄: {memory_base(channel_id)}")
             else:
                 if user_id in self.conversation_history:
                     self.conversation_history[user_id].clear()
@@ -179,10 +256,35 @@ class Memory(commands.Cog, name="Memory"):
             traceback.print_exc()
             return False
 
+    async def send_history(self, destination, user_id, channel_id) -> None:
+        """發送使用者在頻道中的對話歷史"""
+        # 顯示記憶體中的歷史
+        memory_history = list(self.conversation_history[user_id][channel_id])
+        
+        # 顯示檔案中的歷史
+        file_memory = await asyncio.to_thread(get_memory, channel_id)
+        
+        if not memory_history and not file_memory:
+            await outbound.send(destination, "您在此頻道沒有對話歷史", channel_id=channel_id)
+            return
+        
+        if memory_history:
+            # 打包成 embed 一次發送，而不是每條歷史各發一則訊息
+            lines = []
+            for i, msg in enumerate(memory_history):
+                content = msg["parts"][0]["text"] if msg["parts"] else "空內容"
+                lines.append(f"{i+1}. {msg['role']}: {content[:100]}..." if len(content) > 100 else f"{i+1}. {msg['role']}: {content}")
+            await outbound.send_lines(destination, lines, title=f"記憶體中有 {len(memory_history)} 條對話歷史",
+                                      channel_id=channel_id)
+        
+        if file_memory:
+            await outbound.send_text(destination, f"檔案中的對話歷史：\n{file_memory}", channel_id=channel_id,
+                                     filename="memory.txt")
+
     @commands.command()
     async def clear_memory(self, ctx):
         """清除與機器人的對話歷史"""
-        success = self.clear_user_history(ctx.author.id, ctx.channel.id)
+        success = await self.clear_user_history(ctx.author.id, ctx.channel.id)
         if success:
             await ctx.send("✅ 已清除您在此頻道的對話歷史")
         else:
@@ -192,53 +294,62 @@ class Memory(commands.Cog, name="Memory"):
     async def show_memory(self, ctx):
         """顯示當前的對話歷史（用於調試）"""
         try:
-            # 顯示記憶體中的歷史
-            memory_history = list(self.conversation_history[ctx.author.id][ctx.channel.id])
-            
-            # 顯示檔案中的歷史
-            file_memory = get_memory(ctx.channel.id)
-            
-            if not memory_history and not file_memory:
-                await ctx.send("您在此頻道沒有對話歷史")
-                return
-            
-            if memory_history:
-                await ctx.send(f"記憶體中有 {len(memory_history)} 條對話歷史：")
-                for i, msg in enumerate(memory_history):
-                    content = msg["parts"][0]["text"] if msg["parts"] else "空內容"
-                    await ctx.send(f"{i+1}. {msg['role']}: {content[:100]}..." if len(content) > 100 else f"{i+1}. {msg['role']}: {content}")
-            
-            if file_memory:
-                await ctx.send("檔案中的對話歷史：")
-                # 分段發送，每段最多 1900 字符
-                for i in range(0, len(file_memory), 1900):
-                    chunk = file_memory[i:i+1900]
-                    await ctx.send(chunk)
+            await self.send_history(ctx.channel, ctx.author.id, ctx.channel.id)
         except Exception as e:
             await ctx.send(f"❌ 顯示記憶時發生錯誤: {str(e)}")
             logger.error(f"顯示記憶時發生錯誤: {e}")
             import traceback
             traceback.print_exc()
 
+    memory_group = app_commands.Group(name="memory", description="管理此頻道的對話歷史")
+
+    @memory_group.command(name="clear", description="清除您在此頻道的對話歷史")
+    async def memory_clear(self, interaction: discord.Interaction):
+        await interaction.response.defer(thinking=True)
+        success = await self.clear_user_history(interaction.user.id, interaction.channel_id)
+        if success:
+            await interaction.followup.send("✅ 已清除您在此頻道的對話歷史")
+        else:
+            await interaction.followup.send("❌ 清除對話歷史時發生錯誤，請查看控制台日誌")
+
+    @memory_group.command(name="show", description="顯示您在此頻道的對話歷史")
+    async def memory_show(self, interaction: discord.Interaction):
+        await interaction.response.defer(thinking=True)
+        try:
+            await self.send_history(interaction.followup, interaction.user.id, interaction.channel_id)
+        except Exception as e:
+            await interaction.followup.send(f"❌ 顯示記憶時發生錯誤: {str(e)}")
+            logger.error(f"顯示記憶時發生錯誤: {e}")
+
     @commands.command()
     async def debug_memory_path(self, ctx):
         """顯示記憶檔案路徑（用於調試）"""
         try:
-            file_path = os.path.join(MEMORY_PATH, f"{ctx.channel.id}.json")
-            await ctx.send(f"記憶檔案路徑: {file_path}")
-            
-            if os.path.exists(file_path):
-                size = os.path.getsize(file_path)
-                await ctx.send(f"檔案存在，大小: {size} 字節")
+            base = memory_base(ctx.channel.id)
+            if memory_store.exists(base):
+                file_path = base + memory_store.DATA_EXT
+                await ctx.send(f"記憶檔案路徑: {file_path}")
+                size = os.path.getsize(file_path) + os.path.getsize(base + memory_store.INDEX_EXT)
+                await ctx.send(f"檔案存在，共 {memory_store.count_records(base)} 筆，大小: {size} 字節")
+            elif os.path.exists(base + memory_store.LEGACY_EXT):
+                file_path = base + memory_store.LEGACY_EXT
+                await ctx.send(f"記憶檔案路徑: {file_path}")
+                await ctx.send(f"檔案存在（JSON 格式），大小: {os.path.getsize(file_path)} 字節")
             else:
+                await ctx.send(f"記憶檔案路徑: {base + memory_store.DATA_EXT}")
                 await ctx.send("檔案不存在")
                 
             await ctx.send(f"記憶目錄: {MEMORY_PATH}")
-            if os.path.exists(MEMORY_PATH):
-                files = os.listdir(MEMORY_PATH)
-                await ctx.send(f"目錄中的檔案: {', '.join(files) if files else '無'}")
+            # 使用維護功能最近一次清理時的統計，不在事件迴圈中掃描整個目錄
+            maintenance = self.bot.get_cog("Maintenance")
+            if maintenance and maintenance.stats["last_run"]:
+                stats = maintenance.stats
+                await ctx.send(
+                    f"目錄中共有 {stats['memory_files']} 個記憶，總大小: {stats['memory_bytes']} 字節"
+                    f"（統計於 {stats['last_run']}）"
+                )
             else:
-                await ctx.send("記憶目錄不存在")
+                await ctx.send("尚未統計目錄用量，請稍後使用 `!memory_stats` 查看")
         except Exception as e:
             await ctx.send(f"❌ 調試記憶路徑時發生錯誤: {str(e)}")
             logger.error(f"調試記憶路徑時發生錯誤: {e}")
@@ -1,13 +1,112 @@
 import os
 import json
+import asyncio
+import tempfile
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional
 from loguru import logger
 
-class ConfigManager:
-    def __init__(self):
-        self.config_dir = os.path.dirname(os.path.abspath(__file__))
-        self.bot_config = self.load_config("bot_config.json")
-       
-       
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _freeze(value):
+    """將 JSON 資料轉為唯讀結構"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _thaw(value):
+    """將唯讀結構還原為可寫入 JSON 的資料"""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+def atomic_write_json(path: str, data, indent: int = 4) -> None:
+    """先寫入同目錄的暫存檔再替換，避免寫到一半的檔案被讀取"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@dataclass(frozen=True)
+class BotConfig:
+    """bot_config.json 的不可變快照
+
+    常用欄位有型別與預設值；其餘區塊（如 "logging"、"routing"）可用 get() 或 [] 讀取唯讀內容。
+    """
+    prefix: str = "!"
+    activity: Optional[str] = None
+    status: str = "online"
+    system_prompt: str = ""
+    personality: str = ""
+    chat_memory: bool = False
+    gpt_api: str = "gemini"
+    model: str = "gemini-1.5-flash"
+    use_search_engine: bool = False
+    raw: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}), repr=False)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BotConfig":
+        defaults = cls()
+        return cls(
+            prefix=data.get("prefix", defaults.prefix),
+            activity=data.get("activity", defaults.activity),
+            status=data.get("status", defaults.status),
+            system_prompt=data.get("system_prompt", defaults.system_prompt),
+            personality=data.get("personality", defaults.personality),
+            chat_memory=data.get("chat_memory", defaults.chat_memory),
+            gpt_api=data.get("gpt_api", defaults.gpt_api),
+            model=data.get("model", defaults.model),
+            use_search_engine=data.get("use_search_engine", defaults.use_search_engine),
+            raw=_freeze(data),
+        )
+
+    def get(self, key: str, default=None):
+        return self.raw.get(key, default)
+
+    def __getitem__(self, key: str):
+        return self.raw[key]
+
+ConfigListener = Callable[[BotConfig, BotConfig], None]
+
+class ConfigService:
+    """全程式共用的設定服務
+
+    - 以不可變快照提供設定，更新時整份替換
+    - 寫入時先寫暫存檔再替換，並在執行緒中進行
+    - 監看設定檔變更，自動重新載入
+    - 設定變更時通知訂閱者，讓相關快取自行失效
+    """
+    def __init__(self, filename: str = "bot_config.json"):
+        self.config_dir = CONFIG_DIR
+        self.filename = filename
+        self.path = os.path.join(self.config_dir, filename)
+        self.listeners: List[ConfigListener] = []
+        self._snapshot = BotConfig.from_dict(self.load_config(filename))
+        self._mtime = self._get_mtime()
+        self._lock: Optional[asyncio.Lock] = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+    @property
+    def snapshot(self) -> BotConfig:
+        return self._snapshot
+
+    @property
+    def bot_config(self) -> BotConfig:
+        """目前的設定快照（與舊版 ConfigManager.bot_config 相容）"""
+        return self._snapshot
 
     def load_config(self, filename) -> dict:
         config_path = os.path.join(self.config_dir, filename)
@@ -21,5 +120,77 @@ class ConfigManager:
             logger.error(f"⚠️ 設定檔 {config_path} 格式錯誤，請檢查 JSON 語法！")
             return {}
 
-# 建立全域配置管理器
-config = ConfigManager()
\ No newline at end of file
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def subscribe(self, listener: ConfigListener) -> ConfigListener:
+        """訂閱設定變更，listener(舊快照, 新快照)"""
+        self.listeners.append(listener)
+        return listener
+
+    def unsubscribe(self, listener: ConfigListener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _swap(self, snapshot: BotConfig) -> None:
+        old, self._snapshot = self._snapshot, snapshot
+        for listener in list(self.listeners):
+            try:
+                listener(old, snapshot)
+            except Exception as e:
+                logger.error(f"⚠️ 設定變更通知失敗: {e}")
+
+    async def update(self, **changes) -> BotConfig:
+        """更新設定並寫回設定檔"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            data = _thaw(self._snapshot.raw)
+            data.update(changes)
+            await asyncio.to_thread(atomic_write_json, self.path, data)
+            self._mtime = self._get_mtime()
+            self._swap(BotConfig.from_dict(data))
+            return self._snapshot
+
+    def reload(self) -> bool:
+        """設定檔有變更時重新載入，回傳是否有重新載入"""
+        mtime = self._get_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            # 格式錯誤時保留目前的設定
+            logger.error(f"⚠️ 重新載入設定檔失敗，繼續使用目前的設定: {e}")
+            return False
+        snapshot = BotConfig.from_dict(data)
+        if snapshot == self._snapshot:
+            return False
+        self._swap(snapshot)
+        logger.info(f"已重新載入設定檔: {self.path}")
+        return True
+
+    def start_watching(self, interval: float = 2.0) -> None:
+        """在背景定期檢查設定檔是否變更"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.ensure_future(self._watch(interval))
+
+    def stop_watching(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self._lock is not None and self._lock.locked():
+                continue
+            self.reload()
+
+# 建立全域配置服務
+config = ConfigService()
@@ -8,10 +8,9 @@ from discord.ext import commands
 from loguru import logger
 from typing import cast
 
-from config.config import ConfigManager
-
-# 載入設定檔
-config = ConfigManager()
+from config.config import config
+from utils.log import setup_logging
+from utils.dispatch import MessageFilter
 
 # 載入環境變數
 load_dotenv(override=True)
@@ -29,21 +28,39 @@ TOKEN = cast(str, TOKEN)
 # 設定系統日誌
 log_path = "./log/discord_bot.log"
 level = os.getenv("LOG_LEVEL", "INFO")
-logger.add(log_path, level=level, format="{time} | {level} | {message}", rotation="10 MB")
+setup_logging(log_path, level, config.bot_config.get("logging", {}))
 
 # 機器初始化設定
 intents = discord.Intents.default()
 intents.messages = True
 intents.members = True
-intents.message_content = True
+# 特權的訊息內容意圖可關閉，改以斜線命令互動；提及機器人的訊息仍會帶有內容
+intents.message_content = config.bot_config.get("message_content_intent", True)
+
+# 訊息預先過濾，前綴與提及字串只計算一次
+message_filter = MessageFilter(config.snapshot.prefix, config.bot_config.get("channel_allowlist", {}))
+
+@config.subscribe
+def on_config_change(old, new):
+    # 設定檔變更時重新計算前綴與允許頻道
+    message_filter.configure(new.prefix, new.get("channel_allowlist", {}))
+    # 日誌設定變更時重新設定輸出
+    if old.get("logging") != new.get("logging"):
+        setup_logging(log_path, level, new.get("logging", {}))
+        logger.info("已套用新的日誌設定")
+    # 狀態與活動變更時更新顯示
+    if (old.activity, old.status) != (new.activity, new.status) and bot.is_ready():
+        asyncio.ensure_future(apply_presence(new))
 
 # 自定義前綴檢查函數
 def get_prefix(bot, message):
     # 返回預設前綴和提及作為可能的前綴
-    return commands.when_mentioned_or(config.bot_config['prefix'])(bot, message)
+    return message_filter.prefixes
 
 # 使用自定義前綴函數初始化機器人
 bot = commands.Bot(command_prefix=get_prefix, help_command=None, intents=intents)
+# 讓各 cog 共用相同的頻道允許清單
+bot.message_filter = message_filter
 
 status_dict = {
     'online': discord.Status.online,
@@ -52,12 +69,23 @@ status_dict = {
     'invisible': discord.Status.invisible
 }
 
+async def apply_presence(snapshot):
+    game = discord.Game(snapshot.activity) if snapshot.activity else None
+    await bot.change_presence(status=status_dict.get(snapshot.status, discord.Status.online), activity=game)
+
+@bot.event
+async def setup_hook():
+    # 只在啟動時同步斜線命令一次，避免每次重新連線都觸發同步的速率限制
+    synced = await bot.tree.sync()
+    logger.info(f"已同步 {len(synced)} 個斜線命令")
+    if not intents.message_content:
+        logger.info("未啟用訊息內容意圖，前綴命令只能透過提及機器人使用")
+
 @bot.event
 async def on_ready():
     logger.info(f"✅ 已登入：{bot.user}")
-    game = discord.Game(config.bot_config['activity'])
-    await bot.tree.sync()
-    await bot.change_presence(status=status_dict[config.bot_config['status']], activity=game)
+    message_filter.set_bot_user(bot.user.id)
+    await apply_presence(config.snapshot)
     
     # 打印所有已加載的 cogs
     logger.info(f"已加載的 cogs: {list(bot.cogs.keys())}")
@@ -75,23 +103,24 @@ async def on_ready():
 
 @bot.event
 async def on_message(message):
-    # 忽略機器人自己的消息
-    if message.author == bot.user:
+    # 忽略機器人的消息、不是以前綴或提及開頭的消息，以及不在允許頻道中的消息
+    if not message_filter.accepts(message):
         return
 
-    # 檢查消息是否提及機器人，並確保 bot.user 不為 None
-    if bot.user and bot.user in message.mentions:
-        # 移除消息中的提及部分，獲取實際命令內容
-        content = message.content.replace(f'<@{bot.user.id}>', '').replace(f'<@!{bot.user.id}>', '').strip()
-        
-        # 如果消息只有提及而沒有其他內容，可以添加預設回應
-        if not content:
-            await message.channel.send(f'你好！你可以用 `{config.bot_config["prefix"]}help` 或直接提及我來使用命令。')
-            return
+    # 如果消息只有提及而沒有其他內容，可以添加預設回應
+    if message_filter.is_bare_mention(message.content):
+        await message.channel.send(f'你好！你可以用 `{config.snapshot.prefix}help` 或直接提及我來使用命令。')
+        return
 
     # 繼續處理命令
     await bot.process_commands(message)
 
+@bot.command(name="dispatch_stats")
+async def dispatch_stats(ctx):
+    """顯示訊息預先過濾的統計"""
+    total = message_filter.accepted + message_filter.rejected
+    await ctx.send(f"已處理 {message_filter.accepted} 則訊息，略過 {message_filter.rejected} 則（共 {total} 則）")
+
 # 載入功能
 async def load_extensions():
     all_cogs = os.listdir("./cogs")
@@ -117,9 +146,16 @@ async def load_extensions():
                 logger.error(f"載入擴展 {filename} 失敗: {e}")
 
 async def main():
-    async with bot:
-        await load_extensions()
-        await bot.start(TOKEN)
+    try:
+        async with bot:
+            await load_extensions()
+            # 監看設定檔，變更時不需重新啟動
+            config.start_watching()
+            await bot.start(TOKEN)
+    finally:
+        config.stop_watching()
+        # 等待佇列中的日誌寫入完成
+        await logger.complete()
 
 if __name__ == "__main__":
     try:
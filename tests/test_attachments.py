@@ -0,0 +1,156 @@
+import io
+import asyncio
+import contextlib
+import functools
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from PIL import Image
+
+from utils.attachments import AttachmentPipeline, AttachmentTooLarge, downscale_image
+
+MAX_BYTES = 64 * 1024
+
+@functools.lru_cache(maxsize=None)
+def png_bytes(size, mode="RGBA") -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, size).save(output, format="PNG")
+    return output.getvalue()
+
+def make_attachment(attachment_id, url, size=None, filename="image.png"):
+    return SimpleNamespace(id=attachment_id, url=url, size=size, filename=filename, content_type="image/png")
+
+@contextlib.asynccontextmanager
+async def local_server():
+    """在本機啟動代替 Discord CDN 的 HTTP 伺服器，回傳 (base_url, 各路徑的請求次數)"""
+    hits = Counter()
+    image = png_bytes((2048, 1024))
+    bomb = png_bytes((20000, 20000), mode="1")
+
+    async def chunked(request, total):
+        response = web.StreamResponse()
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        chunk = b"x" * 4096
+        for _ in range(total // len(chunk)):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def handle(request):
+        name = request.match_info["name"]
+        hits[name] += 1
+        if name in ("image", "image-copy"):
+            return web.Response(body=image, content_type="image/png")
+        if name == "bomb":
+            return web.Response(body=bomb, content_type="image/png")
+        if name == "small-stream":
+            return await chunked(request, MAX_BYTES // 2)
+        if name == "large-stream":
+            return await chunked(request, MAX_BYTES * 4)
+        if name == "large-declared":
+            return web.Response(body=b"x" * (MAX_BYTES * 2))
+        raise web.HTTPNotFound()
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}", hits
+    finally:
+        await runner.cleanup()
+
+def run_with_pipeline(test, **settings):
+    async def main():
+        pipeline = AttachmentPipeline({"max_bytes": MAX_BYTES, **settings})
+        try:
+            async with local_server() as (base_url, hits):
+                await test(pipeline, base_url, hits)
+        finally:
+            await pipeline.close()
+    asyncio.run(main())
+
+def test_download_streams_under_limit():
+    async def test(pipeline, base_url, hits):
+        data = await pipeline.download(f"{base_url}/small-stream")
+        assert len(data) == MAX_BYTES // 2
+    run_with_pipeline(test)
+
+def test_download_stops_when_stream_exceeds_limit():
+    async def test(pipeline, base_url, hits):
+        with pytest.raises(AttachmentTooLarge):
+            await pipeline.download(f"{base_url}/large-stream")
+    run_with_pipeline(test)
+
+def test_download_rejects_large_content_length():
+    async def test(pipeline, base_url, hits):
+        # 由 Content-Length 判斷，尚未讀取內容就拒絕
+        with pytest.raises(AttachmentTooLarge, match=rf"^{MAX_BYTES * 2} 字節$"):
+            await pipeline.download(f"{base_url}/large-declared")
+    run_with_pipeline(test)
+
+def test_declared_attachment_size_skips_download():
+    async def test(pipeline, base_url, hits):
+        parts = await pipeline.prepare([make_attachment(1, f"{base_url}/image", size=MAX_BYTES + 1)])
+        assert parts == []
+        assert hits["image"] == 0
+    run_with_pipeline(test)
+
+def test_cache_hit_by_attachment_id():
+    async def test(pipeline, base_url, hits):
+        attachment = make_attachment(1, f"{base_url}/image")
+        first = await pipeline.prepare([attachment])
+        second = await pipeline.prepare([attachment])
+        assert first == second and len(first) == 1
+        assert hits["image"] == 1
+    run_with_pipeline(test)
+
+def test_cache_hit_by_content_hash():
+    async def test(pipeline, base_url, hits):
+        first = await pipeline.prepare_one(make_attachment(1, f"{base_url}/image"))
+        # 不同附件 ID 但內容相同：需要下載才能計算雜湊，但不會再次縮小
+        copy = make_attachment(2, f"{base_url}/image-copy")
+        second = await pipeline.prepare_one(copy)
+        assert second is first
+        assert sum(key.startswith("sha:") for key in pipeline.cache) == 1
+        # 之後以附件 ID 命中，不會再下載
+        await pipeline.prepare_one(copy)
+        assert hits["image"] == 1 and hits["image-copy"] == 1
+    run_with_pipeline(test)
+
+def test_prepare_downscales_to_jpeg():
+    async def test(pipeline, base_url, hits):
+        [part] = await pipeline.prepare([make_attachment(1, f"{base_url}/image")])
+        assert part["mime_type"] == "image/jpeg"
+        with Image.open(io.BytesIO(part["data"])) as image:
+            assert image.format == "JPEG"
+            assert image.mode == "RGB"
+            assert image.size == (256, 128)
+    run_with_pipeline(test, max_dimension=256)
+
+def test_prepare_skips_non_images_and_limits_count():
+    async def test(pipeline, base_url, hits):
+        document = make_attachment(1, f"{base_url}/image", filename="notes.txt")
+        document.content_type = "text/plain"
+        images = [make_attachment(i, f"{base_url}/image") for i in range(2, 6)]
+        parts = await pipeline.prepare([document] + images)
+        assert len(parts) == 2
+    run_with_pipeline(test, max_count=2)
+
+def test_downscale_rejects_decompression_bomb():
+    with pytest.raises(Image.DecompressionBombError):
+        downscale_image(png_bytes((20000, 20000), mode="1"), 1024, 85)
+
+def test_prepare_skips_decompression_bomb():
+    async def test(pipeline, base_url, hits):
+        bomb = make_attachment(1, f"{base_url}/bomb")
+        image = make_attachment(2, f"{base_url}/image")
+        parts = await pipeline.prepare([bomb, image])
+        assert len(parts) == 1
+    run_with_pipeline(test)
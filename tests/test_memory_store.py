@@ -0,0 +1,122 @@
+import os
+import json
+
+import pytest
+
+from utils import memory_store
+from cogs import memory
+
+def make_record(i):
+    return {"使用者": "user", "使用者輸入": f"問題 {i}", "參考資料": "", "機器人回覆": f"回答 {i}", "時間": "2024-01-01 00:00:00"}
+
+def inputs(records):
+    return [record["使用者輸入"] for record in records]
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "42")
+
+@pytest.fixture
+def memory_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_PATH", str(tmp_path))
+    return tmp_path
+
+def write_legacy(path, records):
+    # 舊版記憶檔可能帶有 BOM
+    with open(path, "w", encoding="utf-8-sig") as f:
+        json.dump(records, f, ensure_ascii=False)
+
+def test_append_then_read_tail(base):
+    for i in range(5):
+        assert memory_store.append_record(base, make_record(i)) == i + 1
+    assert memory_store.exists(base)
+    assert memory_store.count_records(base) == 5
+    assert inputs(memory_store.read_tail(base, 3)) == ["問題 2", "問題 3", "問題 4"]
+    assert memory_store.read_tail(base, 10) == [make_record(i) for i in range(5)]
+    assert memory_store.read_tail(base, 0) == []
+
+def test_convert_legacy(base):
+    records = [make_record(i) for i in range(3)]
+    write_legacy(base + memory_store.LEGACY_EXT, records)
+    assert memory_store.convert_legacy(base)
+    assert not os.path.exists(base + memory_store.LEGACY_EXT)
+    assert memory_store.read_tail(base, 10) == records
+    # 沒有舊記憶檔時不做任何事
+    assert not memory_store.convert_legacy(base)
+
+def test_convert_directory(tmp_path):
+    for channel_id in (1, 2):
+        write_legacy(tmp_path / f"{channel_id}{memory_store.LEGACY_EXT}", [make_record(channel_id)])
+    assert memory_store.convert_directory(str(tmp_path)) == 2
+    assert inputs(memory_store.read_tail(str(tmp_path / "2"), 1)) == ["問題 2"]
+
+def test_get_memory_reads_legacy_json_then_save_converts(memory_dir):
+    write_legacy(memory_dir / "7.json", [make_record(i) for i in range(3)])
+    text = memory.get_memory(7, num_memories=2)
+    assert "問題 1" in text and "問題 2" in text and "問題 0" not in text
+    # 讀取不會轉換，第一次寫入時才轉換
+    assert (memory_dir / "7.json").exists()
+
+    memory.save_memory(7, "user", "問題 3", "", "回答 3")
+    assert not (memory_dir / "7.json").exists()
+    base = memory.memory_base(7)
+    assert memory_store.count_records(base) == 4
+    assert inputs(memory_store.read_tail(base, 2)) == ["問題 2", "問題 3"]
+
+def test_record_appended_without_index_entry(base):
+    for i in range(3):
+        memory_store.append_record(base, make_record(i))
+    # 寫入資料後、寫入索引前當機
+    with open(base + memory_store.DATA_EXT, "ab") as f:
+        f.write(memory_store._encode(make_record(3)))
+    assert inputs(memory_store.read_tail(base, 2)) == ["問題 2", "問題 3"]
+    assert memory_store.count_records(base) == 4
+
+def test_truncated_partial_record(base):
+    for i in range(3):
+        memory_store.append_record(base, make_record(i))
+    size = os.path.getsize(base + memory_store.DATA_EXT)
+    # 附加到一半時當機，只留下部分紀錄
+    with open(base + memory_store.DATA_EXT, "ab") as f:
+        f.write(memory_store._encode(make_record(3))[:7])
+    assert inputs(memory_store.read_tail(base, 10)) == ["問題 0", "問題 1", "問題 2"]
+    assert os.path.getsize(base + memory_store.DATA_EXT) == size
+
+    memory_store.append_record(base, make_record(4))
+    assert inputs(memory_store.read_tail(base, 2)) == ["問題 2", "問題 4"]
+
+def test_stale_index_after_rewrite(base):
+    for i in range(10):
+        memory_store.append_record(base, make_record(i))
+    with open(base + memory_store.INDEX_EXT, "rb") as f:
+        old_index = f.read()
+    # 替換資料檔後、替換索引前當機
+    memory_store.write_records(base, memory_store.read_tail(base, 2))
+    with open(base + memory_store.INDEX_EXT, "wb") as f:
+        f.write(old_index)
+    assert inputs(memory_store.read_tail(base, 10)) == ["問題 8", "問題 9"]
+    assert memory_store.count_records(base) == 2
+
+def test_save_memory_rewrites_at_twice_max(memory_dir):
+    base = memory.memory_base(9)
+    for i in range(6):
+        memory.save_memory(9, "user", f"問題 {i}", "", f"回答 {i}", max_memories=3)
+    assert memory_store.count_records(base) == 6
+    size = os.path.getsize(base + memory_store.DATA_EXT)
+
+    # 超過兩倍上限時才改寫，只保留最新的 max_memories 筆
+    memory.save_memory(9, "user", "問題 6", "", "回答 6", max_memories=3)
+    assert memory_store.count_records(base) == 3
+    assert os.path.getsize(base + memory_store.DATA_EXT) < size
+    assert inputs(memory_store.read_tail(base, 10)) == ["問題 4", "問題 5", "問題 6"]
+
+def test_memory_version_changes_on_write_compact_and_delete(memory_dir):
+    versions = [memory.memory_version(5)]
+    for i in range(4):
+        memory.save_memory(5, "user", f"問題 {i}", "", f"回答 {i}")
+    versions.append(memory.memory_version(5))
+    assert memory.compact_memory(5, keep=2)
+    versions.append(memory.memory_version(5))
+    assert memory.delete_memory(5)
+    versions.append(memory.memory_version(5))
+    assert versions == sorted(set(versions))
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from utils.outbound import FENCE, split_message
+
+def fence_lines(chunk):
+    return [line for line in chunk.split("\n") if line.strip().startswith(FENCE)]
+
+def content(text):
+    # 去掉 ``` 行與所有空白後比較，切分時補上的區塊邊界與斷行不影響內容
+    return "".join("".join(line.split()) for line in text.split("\n") if not line.strip().startswith(FENCE))
+
+def random_text(rng):
+    lines = []
+    in_block = False
+    for _ in range(rng.randint(1, 120)):
+        roll = rng.random()
+        if roll < 0.1:
+            if in_block:
+                lines.append(FENCE)
+            else:
+                # 原文不含空的程式碼區塊
+                lines.extend([rng.choice([FENCE, "```py", "```diff"]), "x = 1"])
+            in_block = not in_block
+        elif roll < 0.2:
+            lines.append("")
+        elif roll < 0.3:
+            # 超過上限的長行，有時沒有任何可斷開的字元
+            lines.append(rng.choice(["a", "測試。", "word "]) * rng.randint(100, 1500))
+        else:
+            lines.append(" ".join(rng.choice(["print(x)", "你好", "foo", "bar；", "baz!"]) for _ in range(rng.randint(1, 30))))
+    if in_block:
+        lines.append(FENCE)
+    return "\n".join(lines)
+
+def assert_valid_split(text, limit):
+    chunks = split_message(text, limit)
+    for chunk in chunks:
+        assert len(chunk) <= limit
+        assert chunk.strip()
+        assert len(fence_lines(chunk)) % 2 == 0
+        # 不會出現剛開啟就結束的空程式碼區塊
+        lines = chunk.split("\n")
+        for opening, closing in zip(lines, lines[1:]):
+            assert not (opening.strip().startswith(FENCE) and closing.strip() == FENCE and opening.strip() != FENCE)
+    assert content("\n".join(chunks)) == content(text)
+    return chunks
+
+def test_short_text_is_returned_as_is():
+    assert split_message("hello\n```py\nx\n```", 100) == ["hello\n```py\nx\n```"]
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_split_respects_limit_fences_and_content(seed):
+    rng = random.Random(seed)
+    assert_valid_split(random_text(rng), rng.choice([200, 500, 1900]))
+
+def test_code_block_filling_a_chunk():
+    text = FENCE + "\n" + "b" * 1890 + "\n" + FENCE + "\nafter"
+    chunks = assert_valid_split(text, 1900)
+    assert chunks[-1].endswith("after")
+
+def test_reopens_block_with_same_language():
+    text = "```py\n" + "\n".join(f"print({i})" for i in range(200)) + "\n```"
+    chunks = assert_valid_split(text, 500)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("```py\n")
+        assert chunk.endswith("\n" + FENCE)
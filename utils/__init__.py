@@ -0,0 +1 @@
+# 共用工具模組（非 discord 擴展，不會被 load_extensions 載入）
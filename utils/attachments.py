@@ -0,0 +1,127 @@
+import io
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+import aiohttp
+from PIL import Image, ImageOps
+from loguru import logger
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
+
+class AttachmentTooLarge(Exception):
+    """附件超過允許的大小"""
+
+def is_image(attachment) -> bool:
+    content_type = getattr(attachment, "content_type", None) or ""
+    if content_type.startswith("image/"):
+        return True
+    return attachment.filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def downscale_image(data: bytes, max_dimension: int, quality: int) -> bytes:
+    """縮小圖片並重新編碼為 JPEG（在執行緒中呼叫）"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+class AttachmentPipeline:
+    """下載、縮小圖片附件並轉換為 Gemini 的多模態輸入
+
+    - 共用一個 aiohttp 連線，串流下載並限制最大位元組數
+    - 圖片縮小與重新編碼在執行緒中進行，不阻塞事件迴圈
+    - 以附件 ID 與內容雜湊快取處理結果，重複引用的圖片不會再次下載或處理
+    """
+    def __init__(self, settings: Optional[dict] = None):
+        self.session: Optional[aiohttp.ClientSession] = None
+        # "id:<附件 ID>" 或 "sha:<內容雜湊>" -> 處理後的多模態輸入
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.configure(settings or {})
+
+    def configure(self, settings: dict) -> None:
+        """套用附件設定（設定變更時也會呼叫）"""
+        self.enabled = settings.get("enabled", True)
+        self.max_bytes = settings.get("max_bytes", 8 * 1024 * 1024)
+        self.max_count = settings.get("max_count", 4)
+        self.max_dimension = settings.get("max_dimension", 1024)
+        self.jpeg_quality = settings.get("jpeg_quality", 85)
+        self.cache_size = settings.get("cache_size", 128)
+        self.timeout = settings.get("timeout_seconds", 20)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def cache_get(self, key: str) -> Optional[dict]:
+        part = self.cache.get(key)
+        if part is not None:
+            self.cache.move_to_end(key)
+        return part
+
+    def cache_put(self, key: str, part: dict) -> None:
+        self.cache[key] = part
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def download(self, url: str) -> bytes:
+        """串流下載，超過 max_bytes 時立即中止"""
+        session = await self.get_session()
+        # 逾時設定在每次請求時套用，設定變更後不必重建連線
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+            response.raise_for_status()
+            if response.content_length is not None and response.content_length > self.max_bytes:
+                raise AttachmentTooLarge(f"{response.content_length} 字節")
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) > self.max_bytes:
+                    raise AttachmentTooLarge(f"超過 {self.max_bytes} 字節")
+            return bytes(buffer)
+
+    async def prepare_one(self, attachment) -> dict:
+        id_key = f"id:{attachment.id}"
+        part = self.cache_get(id_key)
+        if part is not None:
+            return part
+
+        if attachment.size and attachment.size > self.max_bytes:
+            raise AttachmentTooLarge(f"{attachment.size} 字節")
+
+        data = await self.download(attachment.url)
+        sha_key = f"sha:{hashlib.sha256(data).hexdigest()}"
+        part = self.cache_get(sha_key)
+        if part is None:
+            image = await asyncio.to_thread(downscale_image, data, self.max_dimension, self.jpeg_quality)
+            part = {"mime_type": "image/jpeg", "data": image}
+            self.cache_put(sha_key, part)
+        self.cache_put(id_key, part)
+        return part
+
+    async def prepare(self, attachments: Sequence) -> List[dict]:
+        """將訊息附件轉換為多模態輸入，無法處理的附件會被略過"""
+        if not self.enabled:
+            return []
+        parts = []
+        for attachment in [a for a in attachments if is_image(a)][:self.max_count]:
+            try:
+                parts.append(await self.prepare_one(attachment))
+            except AttachmentTooLarge as e:
+                logger.warning(f"[附件] {attachment.filename} 過大，已略過: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logger.error(f"[附件] 無法處理 {attachment.filename}: {e}")
+            except (Image.DecompressionBombError, ValueError) as e:
+                # 像素數過大（解壓縮炸彈）或無法解碼的圖片
+                logger.warning(f"[附件] {attachment.filename} 無法解碼，已略過: {e}")
+        return parts
@@ -0,0 +1,62 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+class MessageFilter:
+    """在 process_commands 之前快速判斷訊息是否可能是給機器人的
+
+    前綴與提及字串在登入後預先計算一次，與機器人無關的訊息直接略過，
+    分派成本只跟發給機器人的訊息量有關，而不是整個伺服器的訊息量。
+    """
+    def __init__(self, prefix: str, channel_allowlist: Optional[Dict[str, Iterable[int]]] = None):
+        self.user_id: Optional[int] = None
+        self.mentions: Tuple[str, ...] = ()
+        self.accepted = 0
+        self.rejected = 0
+        self.configure(prefix, channel_allowlist)
+
+    def configure(self, prefix: str, channel_allowlist: Optional[Dict[str, Iterable[int]]] = None) -> None:
+        """套用前綴與頻道允許清單（設定變更時也會呼叫）"""
+        self.prefix = prefix
+        # 伺服器 ID -> 允許回應的頻道（未設定的伺服器不限制）
+        self.channel_allowlist: Dict[int, Set[int]] = {
+            int(guild_id): set(channel_ids) for guild_id, channel_ids in (channel_allowlist or {}).items()
+        }
+        self.prefixes: List[str] = [prefix]
+        self.starts: Tuple[str, ...] = (prefix,)
+        if self.user_id is not None:
+            self.set_bot_user(self.user_id)
+
+    def set_bot_user(self, user_id: int) -> None:
+        """登入後預先計算提及前綴（與 commands.when_mentioned_or 相同）"""
+        self.user_id = user_id
+        self.mentions = (f"<@{user_id}>", f"<@!{user_id}>")
+        self.prefixes = [f"<@{user_id}> ", f"<@!{user_id}> ", self.prefix]
+        self.starts = self.mentions + (self.prefix,)
+
+    def is_bare_mention(self, content: str) -> bool:
+        """訊息是否只有提及機器人而沒有其他內容"""
+        return content.strip() in self.mentions
+
+    def channel_allowed(self, message) -> bool:
+        return self.channel_allowed_in(message.guild, message.channel)
+
+    def channel_allowed_in(self, guild, channel) -> bool:
+        """頻道是否在允許清單中（討論串依其父頻道判斷）"""
+        if guild is None:
+            return True
+        allowed = self.channel_allowlist.get(guild.id)
+        if allowed is None:
+            return True
+        return channel.id in allowed or getattr(channel, "parent_id", None) in allowed
+
+    def accepts(self, message) -> bool:
+        """判斷訊息是否需要交給命令處理，並更新統計"""
+        accepted = (
+            not message.author.bot
+            and message.content.startswith(self.starts)
+            and self.channel_allowed(message)
+        )
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        return accepted
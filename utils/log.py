@@ -0,0 +1,51 @@
+import sys
+import uuid
+import random
+from typing import Dict, Optional
+from loguru import logger
+
+# 文字格式的日誌，加入請求 ID 以便串連同一則回覆的各個階段
+TEXT_FORMAT = "{time} | {level} | {extra[request_id]} | {message}"
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "<cyan>{extra[request_id]}</cyan> | <level>{message}</level>"
+)
+INFO_LEVEL_NO = logger.level("INFO").no
+
+class CategorySampler:
+    """依類別抽樣高頻的 INFO（含）以下日誌，警告與錯誤一律保留"""
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self.rates = {name: float(rate) for name, rate in (rates or {}).items()}
+
+    def __call__(self, record) -> bool:
+        if record["level"].no > INFO_LEVEL_NO:
+            return True
+        rate = self.rates.get(record["extra"].get("category"))
+        if rate is None or rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        return random.random() < rate
+
+def setup_logging(log_path: str, level: str = "INFO", settings: Optional[dict] = None) -> None:
+    """設定日誌輸出
+
+    settings 對應 bot_config.json 的 "logging" 區塊：
+    - enqueue: 是否以背景佇列寫入（不阻塞事件迴圈）
+    - json: 是否輸出 JSON 結構化紀錄
+    - sampling: {類別: 抽樣比例}，例如 {"memory": 0.1}
+    """
+    settings = settings or {}
+    enqueue = settings.get("enqueue", True)
+    serialize = settings.get("json", False)
+    sampler = CategorySampler(settings.get("sampling"))
+
+    logger.remove()
+    logger.configure(extra={"request_id": "-", "category": "-"})
+    logger.add(sys.stderr, level=level, format=CONSOLE_FORMAT, filter=sampler, enqueue=enqueue)
+    logger.add(log_path, level=level, format=TEXT_FORMAT, filter=sampler, enqueue=enqueue,
+               serialize=serialize, rotation="10 MB")
+
+def new_request_id() -> str:
+    """產生用於串連日誌的短請求 ID"""
+    return uuid.uuid4().hex[:12]
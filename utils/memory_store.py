@@ -0,0 +1,209 @@
+"""精簡的二進位記憶格式
+
+每個頻道使用兩個檔案：
+- `<頻道 ID>.mem`：連續的紀錄，每筆為 4 位元組長度（小端序）加上 zlib 壓縮的 JSON
+- `<頻道 ID>.idx`：每筆紀錄在 .mem 中的起始位置（8 位元組，小端序）
+
+讀取最新 N 筆時只需讀取索引尾端，再直接跳到對應位置，不必解析整個檔案。
+.mem 為唯一的真實資料；索引與資料不一致（例如改寫或附加到一半時當機）時，
+會依長度前綴掃描 .mem 重建索引。
+執行 `python -m utils.memory_store [目錄]` 可將舊的 JSON 記憶檔轉換為此格式。
+"""
+import os
+import sys
+import json
+import zlib
+import struct
+from typing import List
+from loguru import logger
+
+DATA_EXT = ".mem"
+INDEX_EXT = ".idx"
+LEGACY_EXT = ".json"
+
+_LENGTH = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+
+# 欄位名稱對照，磁碟上使用短鍵以節省空間
+FIELD_KEYS = {
+    "使用者": "u",
+    "使用者輸入": "i",
+    "參考資料": "s",
+    "機器人回覆": "r",
+    "時間": "t",
+}
+SHORT_KEYS = {short: field for field, short in FIELD_KEYS.items()}
+
+def _encode(record: dict) -> bytes:
+    compact = {FIELD_KEYS.get(key, key): value for key, value in record.items()}
+    payload = zlib.compress(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return _LENGTH.pack(len(payload)) + payload
+
+def _decode(payload: bytes) -> dict:
+    compact = json.loads(zlib.decompress(payload).decode("utf-8"))
+    return {SHORT_KEYS.get(key, key): value for key, value in compact.items()}
+
+class IndexMismatch(Exception):
+    """索引與資料檔不一致"""
+
+def exists(base: str) -> bool:
+    return os.path.exists(base + DATA_EXT) and os.path.exists(base + INDEX_EXT)
+
+def count_records(base: str) -> int:
+    """紀錄筆數（由索引大小推算）"""
+    try:
+        return os.path.getsize(base + INDEX_EXT) // _OFFSET.size
+    except FileNotFoundError:
+        return 0
+
+def disk_usage(base: str) -> int:
+    """頻道記憶檔案（含索引與舊 JSON 檔）的總大小"""
+    total = 0
+    for ext in (DATA_EXT, INDEX_EXT, LEGACY_EXT):
+        try:
+            total += os.path.getsize(base + ext)
+        except FileNotFoundError:
+            pass
+    return total
+
+def _read_tail(base: str, num_records: int) -> List[dict]:
+    index_size = os.path.getsize(base + INDEX_EXT)
+    if index_size % _OFFSET.size:
+        raise IndexMismatch("索引大小不是偏移量的整數倍")
+    total = index_size // _OFFSET.size
+
+    with open(base + DATA_EXT, "rb") as data_file:
+        data_size = os.fstat(data_file.fileno()).st_size
+        if total == 0 and data_size:
+            raise IndexMismatch("索引為空但資料檔不是空的")
+        num_records = min(num_records, total)
+        if num_records <= 0:
+            return []
+
+        with open(base + INDEX_EXT, "rb") as f:
+            f.seek((total - num_records) * _OFFSET.size)
+            offsets = [offset for (offset,) in _OFFSET.iter_unpack(f.read(num_records * _OFFSET.size))]
+
+        records = []
+        end = 0
+        for offset in offsets:
+            if offset + _LENGTH.size > data_size:
+                raise IndexMismatch(f"偏移量 {offset} 超出資料檔大小 {data_size}")
+            data_file.seek(offset)
+            (length,) = _LENGTH.unpack(data_file.read(_LENGTH.size))
+            end = offset + _LENGTH.size + length
+            if end > data_size:
+                raise IndexMismatch(f"紀錄結尾 {end} 超出資料檔大小 {data_size}")
+            records.append(_decode(data_file.read(length)))
+
+        # 最後一筆紀錄必須剛好結束在檔案尾端，否則索引來自另一個版本的資料檔
+        if end != data_size:
+            raise IndexMismatch(f"最後一筆紀錄結束於 {end}，資料檔大小為 {data_size}")
+    return records
+
+def read_tail(base: str, num_records: int) -> List[dict]:
+    """讀取最新的 num_records 筆紀錄（由舊到新），索引與資料不一致時先重建索引"""
+    try:
+        return _read_tail(base, num_records)
+    except (IndexMismatch, struct.error, zlib.error, ValueError) as e:
+        logger.warning(f"[記憶] {base}{INDEX_EXT} 與資料不一致，重建索引: {e}")
+        rebuild_index(base)
+        return _read_tail(base, num_records)
+
+def rebuild_index(base: str) -> int:
+    """依 .mem 中的長度前綴重建索引，回傳紀錄筆數
+
+    尾端不完整或無法解碼的紀錄（寫入到一半時當機）會被截斷。
+    """
+    offsets = []
+    with open(base + DATA_EXT, "r+b") as f:
+        data_size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + _LENGTH.size <= data_size:
+            f.seek(position)
+            (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+            end = position + _LENGTH.size + length
+            if end > data_size:
+                break
+            try:
+                _decode(f.read(length))
+            except (zlib.error, ValueError):
+                break
+            offsets.append(position)
+            position = end
+        if position != data_size:
+            f.truncate(position)
+
+    index_tmp = base + INDEX_EXT + ".tmp"
+    with open(index_tmp, "wb") as f:
+        f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+    os.replace(index_tmp, base + INDEX_EXT)
+    return len(offsets)
+
+def append_record(base: str, record: dict) -> int:
+    """附加一筆紀錄，回傳附加後的紀錄筆數"""
+    data = _encode(record)
+    # 先寫資料再寫索引，索引永遠不會指向不存在的資料
+    with open(base + DATA_EXT, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+    with open(base + INDEX_EXT, "ab") as f:
+        f.write(_OFFSET.pack(offset))
+    return count_records(base)
+
+def write_records(base: str, records: List[dict]) -> None:
+    """以新的紀錄列表改寫檔案（先寫入暫存檔再替換）
+
+    兩個檔案無法一起替換；在兩次替換之間當機或讀取時，read_tail 會偵測到並重建索引。
+    """
+    data_tmp = base + DATA_EXT + ".tmp"
+    index_tmp = base + INDEX_EXT + ".tmp"
+    offset = 0
+    with open(data_tmp, "wb") as data_file, open(index_tmp, "wb") as index_file:
+        for record in records:
+            data = _encode(record)
+            data_file.write(data)
+            index_file.write(_OFFSET.pack(offset))
+            offset += len(data)
+    os.replace(data_tmp, base + DATA_EXT)
+    os.replace(index_tmp, base + INDEX_EXT)
+
+def delete(base: str) -> bool:
+    """刪除二進位與舊 JSON 記憶檔，回傳是否有刪除"""
+    removed = False
+    for ext in (DATA_EXT, INDEX_EXT, LEGACY_EXT):
+        try:
+            os.remove(base + ext)
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+def convert_legacy(base: str) -> bool:
+    """將 `<base>.json` 轉換為二進位格式，回傳是否有轉換"""
+    legacy_path = base + LEGACY_EXT
+    if not os.path.exists(legacy_path):
+        return False
+    with open(legacy_path, "r", encoding="utf-8-sig") as f:
+        memories = json.load(f) or []
+    write_records(base, memories)
+    os.remove(legacy_path)
+    return True
+
+def convert_directory(path: str) -> int:
+    """轉換目錄中所有舊 JSON 記憶檔，回傳轉換的檔案數"""
+    converted = 0
+    with os.scandir(path) as entries:
+        bases = [os.path.join(path, entry.name[:-len(LEGACY_EXT)])
+                 for entry in entries if entry.is_file() and entry.name.endswith(LEGACY_EXT)]
+    for base in bases:
+        try:
+            if convert_legacy(base):
+                converted += 1
+        except Exception as e:
+            logger.error(f"[記憶] 轉換 {base}{LEGACY_EXT} 失敗: {e}")
+    return converted
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "assets/data/memory"
+    logger.info(f"已轉換 {convert_directory(target)} 個記憶檔案: {os.path.abspath(target)}")
@@ -0,0 +1,212 @@
+import io
+import time
+import asyncio
+import contextvars
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+import discord
+from loguru import logger
+from config.config import config
+
+FENCE = "```"
+# 長段落優先在這些字元後斷開
+BREAK_CHARS = "。！？!?；;\n"
+# Discord embed 的長度上限
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBED_TOTAL_LIMIT = 6000
+EMBEDS_PER_MESSAGE = 10
+
+def _split_long_line(line: str, size: int) -> List[str]:
+    """將過長的一行在句尾或空白處斷開，找不到時才硬切"""
+    pieces = []
+    while len(line) > size:
+        window = line[:size]
+        cut = max(window.rfind(char) for char in BREAK_CHARS)
+        if cut < size // 2:
+            cut = window.rfind(" ")
+        if cut < size // 2:
+            cut = size - 1
+        pieces.append(line[:cut + 1])
+        line = line[cut + 1:]
+    pieces.append(line)
+    return pieces
+
+def split_message(text: str, limit: int = 1900) -> List[str]:
+    """依行切分長訊息，不會切斷程式碼區塊
+
+    在程式碼區塊中斷開時，會在前一段補上結尾的 ``` 並在下一段重新開啟相同語言的區塊。
+    """
+    if len(text) <= limit:
+        return [text]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    fence: Optional[str] = None
+
+    for line in text.split("\n"):
+        # 預留重新開啟與結束程式碼區塊的長度
+        reserve = len(fence or FENCE) + len(FENCE) + 2
+        for piece in _split_long_line(line, limit - reserve):
+            extra = len(piece) + (1 if current else 0)
+            # 開啟區塊的行需要預留結尾 ```；結尾的 ``` 本身就是收尾，不需要再預留
+            is_fence = piece.strip().startswith(FENCE)
+            is_closing = fence is not None and is_fence
+            needs_closing = (fence is not None and not is_closing) or (fence is None and is_fence)
+            closing = len(FENCE) + 1 if needs_closing else 0
+            if current and length + extra + closing > limit:
+                if fence and len(current) > 1 and current[-1].strip() == fence:
+                    # 區塊剛開啟就需要換段：把開頭的 ``` 移到下一段，不留下空的區塊
+                    current.pop()
+                    chunks.append("\n".join(current))
+                else:
+                    body = "\n".join(current)
+                    chunks.append(body + "\n" + FENCE if fence else body)
+                if is_closing:
+                    # 前一段已補上結尾，不要在下一段重新開啟空的程式碼區塊
+                    current = []
+                    length = 0
+                    continue
+                current = [fence] if fence else []
+                length = len(fence) if fence else 0
+                extra = len(piece) + (1 if current else 0)
+            current.append(piece)
+            length += extra
+
+        stripped = line.strip()
+        if stripped.startswith(FENCE):
+            fence = None if fence else stripped
+
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def pack_embeds(lines: Sequence[str], title: Optional[str] = None,
+                color: discord.Color = discord.Color.blue()) -> List[List[discord.Embed]]:
+    """將多行短訊息打包成 embed，每則訊息最多 10 個 embed，回傳每則訊息的 embed 列表"""
+    descriptions: List[str] = []
+    current = ""
+    for line in lines:
+        line = line[:EMBED_DESCRIPTION_LIMIT]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > EMBED_DESCRIPTION_LIMIT:
+            descriptions.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        descriptions.append(current)
+
+    messages: List[List[discord.Embed]] = []
+    embeds: List[discord.Embed] = []
+    total = 0
+    for index, description in enumerate(descriptions):
+        embed_title = title if index == 0 else None
+        size = len(description) + len(embed_title or "")
+        if embeds and (len(embeds) >= EMBEDS_PER_MESSAGE or total + size > EMBED_TOTAL_LIMIT):
+            messages.append(embeds)
+            embeds = []
+            total = 0
+        embeds.append(discord.Embed(title=embed_title, description=description, color=color))
+        total += size
+    if embeds:
+        messages.append(embeds)
+    return messages
+
+class OutboundPipeline:
+    """依頻道排隊並控制速率的訊息發送管線
+
+    - 同一頻道的訊息依序發送，並依 Discord 每頻道的速率限制預先排程
+    - 長訊息依 Markdown 與程式碼區塊切分，過長時改以檔案附件發送
+    - 大量短訊息打包成 embed 一次發送
+    """
+    def __init__(self, settings: Optional[dict] = None):
+        # 頻道 ID -> 等待發送的 (目的地, 內容, 參數, future, 發送者的 context)
+        self.queues: Dict[int, Deque[Tuple[discord.abc.Messageable, Optional[str], dict, asyncio.Future,
+                                           contextvars.Context]]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        # 頻道 ID -> 最近幾次發送的時間
+        self.sent: Dict[int, Deque[float]] = {}
+        self.configure(settings or {})
+
+    def configure(self, settings: dict) -> None:
+        self.chunk_size = settings.get("chunk_size", 1900)
+        self.file_threshold = settings.get("file_threshold", 8000)
+        self.rate_limit = settings.get("rate_limit", 5)
+        self.rate_period = settings.get("rate_period", 5.0)
+
+    async def send(self, destination, content: Optional[str] = None, *,
+                   channel_id: Optional[int] = None, **kwargs):
+        """將訊息加入頻道佇列並等待發送完成，回傳發送的訊息"""
+        channel_id = destination.id if channel_id is None else channel_id
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(channel_id, deque()).append(
+            (destination, content, kwargs, future, contextvars.copy_context()))
+        worker = self.workers.get(channel_id)
+        if worker is None or worker.done():
+            # 工作者服務多個請求，不應沿用第一個發送者的 context（請求 ID）
+            self.workers[channel_id] = contextvars.Context().run(asyncio.ensure_future, self._worker(channel_id))
+        return await future
+
+    async def send_text(self, destination, text: str, *, channel_id: Optional[int] = None,
+                        filename: str = "response.md") -> list:
+        """發送長文字：依 Markdown 切分，超過 file_threshold 時改為檔案附件"""
+        if len(text) > self.file_threshold:
+            file = discord.File(io.BytesIO(text.encode("utf-8")), filename=filename)
+            message = await self.send(destination, "📄 內容較長，已改以檔案附件發送：", channel_id=channel_id, file=file)
+            return [message]
+        # 一次排入所有段落，確保順序且不必等待前一段完成才排隊
+        return list(await asyncio.gather(*(
+            self.send(destination, chunk, channel_id=channel_id)
+            for chunk in split_message(text, self.chunk_size)
+        )))
+
+    async def send_lines(self, destination, lines: Sequence[str], *, title: Optional[str] = None,
+                         channel_id: Optional[int] = None) -> list:
+        """將多行短訊息打包成 embed 發送"""
+        return list(await asyncio.gather(*(
+            self.send(destination, channel_id=channel_id, embeds=embeds)
+            for embeds in pack_embeds(lines, title)
+        )))
+
+    async def _wait_for_slot(self, channel_id: int) -> None:
+        sent = self.sent.setdefault(channel_id, deque())
+        now = time.monotonic()
+        while sent and now - sent[0] >= self.rate_period:
+            sent.popleft()
+        if len(sent) >= self.rate_limit:
+            await asyncio.sleep(self.rate_period - (now - sent[0]))
+            sent.popleft()
+        sent.append(time.monotonic())
+
+    async def _worker(self, channel_id: int) -> None:
+        queue = self.queues[channel_id]
+        try:
+            while queue:
+                destination, content, kwargs, future, context = queue.popleft()
+                if future.done():
+                    continue
+                await self._wait_for_slot(channel_id)
+                try:
+                    message = await destination.send(content, **kwargs)
+                    if not future.done():
+                        future.set_result(message)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    else:
+                        context.run(logger.error, f"[發送] 頻道 {channel_id} 發送訊息失敗: {e}")
+        finally:
+            if not queue:
+                self.queues.pop(channel_id, None)
+                self.workers.pop(channel_id, None)
+                sent = self.sent.get(channel_id)
+                if sent and time.monotonic() - sent[-1] >= self.rate_period:
+                    del self.sent[channel_id]
+
+# 建立全域發送管線
+outbound = OutboundPipeline(config.snapshot.get("outbound", {}))
+
+@config.subscribe
+def _on_config_change(old, new):
+    outbound.configure(new.get("outbound", {}))
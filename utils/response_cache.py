@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from loguru import logger
+from config.config import atomic_write_json
+
+class ResponseCache:
+    """重複提問的回應快取
+
+    以最終提示詞與模型、溫度的雜湊為鍵，具備 TTL 與 LRU 上限，
+    可選擇寫入磁碟以便重新啟動後沿用，並合併同時進行的相同請求。
+    """
+    def __init__(self, settings: Optional[dict] = None, path: Optional[str] = None):
+        self.path = path
+        # 鍵 -> (到期時間, 回應)；到期時間使用牆上時間，才能跨重新啟動沿用
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self._save_task: Optional[asyncio.Task] = None
+        self.configure(settings or {})
+        if self.persist:
+            self.load()
+
+    def configure(self, settings: dict) -> None:
+        self.enabled = settings.get("enabled", False)
+        self.ttl = settings.get("ttl_seconds", 3600)
+        self.max_entries = settings.get("max_entries", 256)
+        self.persist = settings.get("persist", True) and self.path is not None
+        self.share_across_users = settings.get("share_across_users", False)
+        self.disabled_channels = set(settings.get("disabled_channels", []))
+
+    def applies_to(self, channel_id: int) -> bool:
+        return self.enabled and channel_id not in self.disabled_channels
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float) -> str:
+        payload = json.dumps([prompt, model, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        self.entries[key] = (time.time() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if self.persist:
+            self.schedule_save()
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[str]],
+                            should_cache: Callable[[str], bool] = bool) -> str:
+        """取得快取的回應；沒有時呼叫 factory，相同鍵的同時請求只會呼叫一次"""
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            pending = self.inflight.get(key)
+            if pending is None:
+                break
+            try:
+                result = await asyncio.shield(pending)
+                self.hits += 1
+                return result
+            except asyncio.CancelledError:
+                # 負責生成的請求被取消時，由等待者重新生成
+                if pending.cancelled():
+                    continue
+                raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免沒有等待者時出現未取得例外的警告
+            future.exception()
+            raise
+        else:
+            if should_cache(result):
+                self.put(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self.inflight.pop(key, None)
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"[快取] 讀取回應快取失敗: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, response) in data.items():
+            if expires_at > now:
+                self.entries[key] = (expires_at, response)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        return {key: list(entry) for key, entry in self.entries.items()}
+
+    def save(self, data: Optional[dict] = None) -> None:
+        """寫入磁碟；未提供 data 時使用目前的內容"""
+        if not self.persist:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write_json(self.path, self.snapshot() if data is None else data, indent=None)
+
+    def schedule_save(self, delay: float = 5.0) -> None:
+        """合併短時間內的多次寫入，在背景執行緒中寫入磁碟"""
+        if self._save_task is not None and not self._save_task.done():
+            return
+        self._save_task = asyncio.ensure_future(self._save_later(delay))
+
+    async def _save_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        try:
+            # 在事件迴圈中取得快照，避免執行緒讀取時內容被修改
+            await asyncio.to_thread(self.save, self.snapshot())
+        except Exception as e:
+            logger.error(f"[快取] 寫入回應快取失敗: {e}")
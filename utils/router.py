@@ -0,0 +1,110 @@
+import time
+import random
+import threading
+from typing import Dict, Hashable, Optional
+from loguru import logger
+
+router_logger = logger.bind(category="router")
+
+class ModelStats:
+    """單一模型的延遲與錯誤率（指數移動平均）"""
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.calls = 0
+        self.updated_at = time.monotonic()
+
+    def record(self, latency: float, ok: bool) -> None:
+        error = 0.0 if ok else 1.0
+        if self.calls == 0:
+            self.latency = latency
+            self.error_rate = error
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+            self.error_rate += self.alpha * (error - self.error_rate)
+        self.calls += 1
+        self.updated_at = time.monotonic()
+
+class ModelRouter:
+    """依輸入特徵與即時延遲、錯誤率選擇模型
+
+    短而簡單的對話交給快速模型，較長或附帶搜尋結果、記憶、圖片的對話交給較強的模型；
+    若選中的模型近期延遲過高或錯誤率過高，則改用另一個模型；
+    被略過的模型仍會分到少量探測流量，統計過久未更新時也會重新嘗試，狀態恢復後即可再次使用。
+    各伺服器可在 "guilds" 中覆寫任何設定。
+    """
+    def __init__(self, default_model: str, settings: Optional[dict] = None):
+        self.default_model = default_model
+        self.settings = settings or {}
+        self.stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def options(self, guild_id: Optional[Hashable] = None) -> dict:
+        """合併全域與伺服器專屬的路由設定"""
+        options = {key: value for key, value in self.settings.items() if key != "guilds"}
+        if guild_id is not None:
+            options.update(self.settings.get("guilds", {}).get(str(guild_id), {}))
+        return options
+
+    def fast_model(self, guild_id: Optional[Hashable] = None) -> str:
+        """分類、判斷等簡單任務使用的模型"""
+        options = self.options(guild_id)
+        if not options.get("enabled", False):
+            return self.default_model
+        return options.get("fast_model", self.default_model)
+
+    def is_healthy(self, model: str, options: dict) -> bool:
+        stats = self.stats.get(model)
+        if stats is None or stats.calls < options.get("min_calls", 5):
+            return True
+        # 統計過久未更新時不再採信，讓模型重新接收流量
+        if time.monotonic() - stats.updated_at > options.get("stats_ttl_seconds", 300):
+            return True
+        return (stats.latency <= options.get("max_latency_seconds", 15.0)
+                and stats.error_rate <= options.get("max_error_rate", 0.3))
+
+    def route(self, text: str, guild_id: Optional[Hashable] = None, channel_id: Optional[int] = None,
+              has_memory: bool = False, has_search: bool = False, has_images: bool = False) -> str:
+        """選擇本次對話使用的模型"""
+        options = self.options(guild_id)
+        if not options.get("enabled", False):
+            return self.default_model
+
+        fast = options.get("fast_model", self.default_model)
+        heavy = options.get("heavy_model", self.default_model)
+        long_input = options.get("long_input_chars", 400)
+
+        reasons = []
+        if len(text) >= long_input:
+            reasons.append("長輸入")
+        if has_search:
+            reasons.append("搜尋結果")
+        if has_memory and len(text) >= long_input // 2:
+            reasons.append("記憶")
+        if has_images:
+            reasons.append("圖片")
+        if "```" in text:
+            reasons.append("程式碼")
+        if channel_id is not None and channel_id in options.get("heavy_channels", []):
+            reasons.append("頻道設定")
+
+        model, other = (heavy, fast) if reasons else (fast, heavy)
+        if not self.is_healthy(model, options) and self.is_healthy(other, options):
+            # 保留少量探測流量，讓狀態不佳的模型有新的統計可以恢復
+            if random.random() < options.get("probe_rate", 0.05):
+                reasons.append(f"{model} 狀態探測")
+            else:
+                reasons.append(f"{model} 狀態不佳")
+                model = other
+
+        router_logger.info(
+            "[路由] 伺服器 ID: {}, 頻道 ID: {}, 模型: {}, 原因: {}",
+            guild_id, channel_id, model, "、".join(reasons) or "簡單對話"
+        )
+        return model
+
+    def record(self, model: str, latency: float, ok: bool) -> None:
+        """記錄一次模型呼叫的結果（可在執行緒中呼叫）"""
+        with self._lock:
+            self.stats.setdefault(model, ModelStats()).record(latency, ok)
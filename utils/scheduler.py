@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Set, Tuple
+from loguru import logger
+
+Job = Callable[[], Awaitable[Any]]
+
+class ChannelScheduler:
+    """頻道內依序執行、跨頻道平行執行的請求排程器
+
+    - 每個頻道一個工作佇列，同一時間最多只有一個工作在執行
+    - 所有頻道共用 max_workers 個工作額度
+    - 空出的額度以伺服器為單位輪流分配，避免單一熱門伺服器佔滿額度
+    """
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max(1, max_workers)
+        self.active = 0
+        # 頻道 -> (工作, 結果, 提交時的 context)
+        self._queues: Dict[int, Deque[Tuple[Job, asyncio.Future, contextvars.Context]]] = defaultdict(deque)
+        # 伺服器 -> 等待分配額度的頻道（依序），以 OrderedDict 實現輪流分配
+        self._ready: "OrderedDict[Hashable, Deque[int]]" = OrderedDict()
+        self._waiting: Set[int] = set()
+        self._running: Set[int] = set()
+        self._guild_of: Dict[int, Hashable] = {}
+
+    def pending(self, channel_id: int) -> int:
+        """頻道中排隊中（尚未執行）的工作數"""
+        return len(self._queues.get(channel_id, ()))
+
+    async def submit(self, guild_id: Hashable, channel_id: int, job: Job) -> Any:
+        """將工作加入頻道佇列，並等待其執行結果
+
+        等待者被取消時，排隊中的工作會被略過，執行中的工作會一併取消。
+        """
+        future = asyncio.get_running_loop().create_future()
+        # 保存提交者的 context，工作才會帶著自己的請求 ID，而不是觸發分配者的
+        self._queues[channel_id].append((job, future, contextvars.copy_context()))
+        self._guild_of[channel_id] = guild_id
+        self._mark_ready(channel_id)
+        self._dispatch()
+        return await future
+
+    def _mark_ready(self, channel_id: int) -> None:
+        if channel_id in self._running or channel_id in self._waiting:
+            return
+        guild_id = self._guild_of[channel_id]
+        self._ready.setdefault(guild_id, deque()).append(channel_id)
+        self._waiting.add(channel_id)
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_workers and self._ready:
+            # 取出最久未分配的伺服器，分配後若仍有等待中的頻道則排到最後
+            guild_id, channels = self._ready.popitem(last=False)
+            channel_id = channels.popleft()
+            if channels:
+                self._ready[guild_id] = channels
+            self._waiting.discard(channel_id)
+
+            job, future, context = self._next_job(channel_id)
+            if job is None:
+                continue
+            self.active += 1
+            self._running.add(channel_id)
+            # 在提交者的 context 中建立工作，工作會取得該 context 的複本
+            context.run(asyncio.ensure_future, self._run(channel_id, job, future))
+
+    def _next_job(self, channel_id: int):
+        queue = self._queues.get(channel_id)
+        while queue:
+            job, future, context = queue.popleft()
+            if not future.done():
+                return job, future, context
+        self._queues.pop(channel_id, None)
+        self._guild_of.pop(channel_id, None)
+        return None, None, None
+
+    async def _run(self, channel_id: int, job: Job, future: asyncio.Future) -> None:
+        task = asyncio.ensure_future(job())
+        future.add_done_callback(lambda f: task.cancel() if f.cancelled() else None)
+        try:
+            result = await task
+            if not future.done():
+                future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            else:
+                logger.error(f"[排程] 頻道 {channel_id} 的工作發生錯誤: {e}")
+        finally:
+            self.active -= 1
+            self._running.discard(channel_id)
+            if self._queues.get(channel_id):
+                self._mark_ready(channel_id)
+            else:
+                self._queues.pop(channel_id, None)
+                self._guild_of.pop(channel_id, None)
+            self._dispatch()